@@ -0,0 +1,73 @@
+"""
+Compares memory taken by cached users with dict-based graph and pixel and with slotted records.
+Run from the repository root: python benchmarks/bench_user_memory.py [number of users]
+"""
+
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Database is never touched, but utils expects its settings on import
+os.environ.setdefault('HEROKU', '1')
+os.environ.setdefault('DATABASE_URL', 'postgresql://localhost/habit_bot')
+
+from utils import User, Graph, Pixel  # noqa: E402
+
+USERS_COUNT = 100_000
+
+
+class DictUser:
+    """
+    User as it was stored before: instance dict, graph and pixel as fresh dicts.
+    """
+
+    def __init__(self, id: int, first_name: str, pixela_token: str = None,
+                 pixela_name: str = None, state: str = None):
+        self.id = id
+        self.first_name = first_name
+        self.pixela_token = pixela_token
+        self.pixela_name = pixela_name
+        self.state = state
+        self.graph = {'id': None, 'name': None, 'unit': None, 'type': None, 'color': None}
+        self.pixel = {'date': None, 'quantity': None}
+        self.pixels = None
+        self.editting = False
+        self.session = None
+
+
+def fill_dict_user(user: DictUser, i: int):
+    user.graph = {'id': f'graph-{i}', 'name': f'Graph {i}', 'unit': 'min', 'type': 'int',
+                  'color': 'shibafu'}
+    user.pixel = {'date': '20220101', 'quantity': i}
+
+
+def fill_user(user: User, i: int):
+    user.graph = Graph(f'graph-{i}', f'Graph {i}', 'min', 'int', 'shibafu')
+    user.pixel = Pixel('20220101', i)
+
+
+def measure(user_class, fill, count: int) -> int:
+    """
+    Creates given number of users with chosen graph and pixel and gets allocated memory.
+    :return: bytes
+    """
+    tracemalloc.start()
+    users = {}
+    for i in range(count):
+        user = user_class(id=i, first_name=f'user{i}', pixela_token=f'token-{i}',
+                          pixela_name=f'name-{i}', state='default')
+        fill(user, i)
+        users[i] = user
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return size
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else USERS_COUNT
+    before = measure(DictUser, fill_dict_user, count)
+    after = measure(User, fill_user, count)
+    print(f'{count} users with dicts:   {before / 2 ** 20:8.1f} MiB ({before / count:.0f} B per user)')
+    print(f'{count} users with records: {after / 2 ** 20:8.1f} MiB ({after / count:.0f} B per user)')
+    print(f'Saved {(1 - after / before) * 100:.0f}%')
@@ -0,0 +1,79 @@
+"""
+Module to export all graphs and pixels of user into csv file.
+"""
+
+import asyncio
+import csv
+import os
+from typing import Dict, TextIO
+
+from pixela import PixelaClient
+
+# Graphs whose pixels are requested from Pixela at the same time during one export
+EXPORT_CONCURRENCY = int(os.getenv('EXPORT_CONCURRENCY', default=3))
+# Exports of one user running at the same time
+EXPORTS_PER_USER = int(os.getenv('EXPORTS_PER_USER', default=1))
+EXPORT_HEADER = ('graph_id', 'graph_name', 'unit', 'type', 'date', 'quantity')
+
+
+class ExportLimiter:
+    """
+    Counts running exports of each user to keep them within limit.
+    """
+
+    def __init__(self, per_user: int = EXPORTS_PER_USER):
+        self.per_user = per_user
+        self.running: Dict[int, int] = {}
+
+    def acquire(self, user_id: int) -> bool:
+        """
+        Takes export slot of user.
+        :param user_id: telegram id
+        :return: false if user already runs as many exports as allowed
+        """
+        if self.running.get(user_id, 0) >= self.per_user:
+            return False
+        self.running[user_id] = self.running.get(user_id, 0) + 1
+        return True
+
+    def release(self, user_id: int):
+        if self.running.get(user_id, 0) <= 1:
+            self.running.pop(user_id, None)
+        else:
+            self.running[user_id] -= 1
+
+
+export_limiter = ExportLimiter()
+
+
+async def write_export(client: PixelaClient, file: TextIO, concurrency: int = EXPORT_CONCURRENCY) -> int:
+    """
+    Fetches pixels of all graphs concurrently and writes them into file as csv rows,
+    each graph as soon as its pixels are received. Export is a backup, so graphs and pixels
+    are loaded from Pixela rather than from cache, which may miss changes made outside of bot.
+    :param client: Pixela client of user
+    :param file: text file opened with newline=''
+    :param concurrency: graphs requested at the same time
+    :return: number of written pixels
+    """
+    writer = csv.writer(file)
+    writer.writerow(EXPORT_HEADER)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def fetch(graph: dict):
+        async with semaphore:
+            return graph, await client.get_pixels(graph['id'], refresh=True)
+
+    rows = 0
+    tasks = [asyncio.ensure_future(fetch(graph)) for graph in await client.get_graphs(refresh=True)]
+    try:
+        for task in asyncio.as_completed(tasks):
+            graph, pixels = await task
+            writer.writerows((graph['id'], graph['name'], graph['unit'], graph['type'],
+                              pixel['date'], pixel['quantity']) for pixel in pixels)
+            rows += len(pixels)
+    finally:
+        # Only left when export failed on one of graphs, the rest are not needed then
+        for task in tasks:
+            task.cancel()
+    return rows
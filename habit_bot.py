@@ -2,22 +2,29 @@
 Creates behaviour for telegram habit bot.
 """
 from datetime import timedelta
+import io
+import tempfile
+import time
 import logging
 from sys import stdout
 import os
 from typing import List
 from functools import partial
 
-import aiohttp
+from aiohttp import web
 import asyncio
 from aiogram import Bot, Dispatcher, executor, types
-from aiogram.utils.executor import start_webhook
+from aiogram.utils.executor import set_webhook
 from aiogram.utils.exceptions import BotBlocked
 from aiogram.utils.callback_data import CallbackData
 from aiogram_calendar import simple_cal_callback, SimpleCalendar
 from pixela import *
 from load_pixel_calendar import *
-from utils import get_user, save_user, User, create_db_user, database
+from utils import get_user, save_user, User, Graph, EMPTY_GRAPH, create_db_user, database, user_writer, UserCache, \
+    cache_pixels, cache_pixel, uncache_pixel, uncache_graph, uncache_user_pixels, warmup_users, WARMUP_USERS, listen_users_changes
+from metrics import query_metrics
+from import_pixels import parse_pixels_csv, upload_pixels, IMPORT_MAX_FILE_SIZE, IMPORT_MAX_ERRORS
+from export_pixels import write_export, export_limiter
 
 
 HEROKU = os.getenv('HEROKU', False)
@@ -45,24 +52,31 @@ WEBHOOK_URL = f'{WEBHOOK_HOST}{WEBHOOK_PATH}'
 # webserver settings
 WEBAPP_HOST = '0.0.0.0'
 WEBAPP_PORT = os.getenv('PORT', default=8000)
+# Metrics are served on a secret path, like webhook, and only if token for it is set
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+METRICS_PATH = f'/metrics/{METRICS_TOKEN}'
 
 USER_CREATION_STATE = ('new user', 'user creation',)
 USER_DELETION_STATE = ('deletion confirmed',)
 USER_DEFAULT_STATE = ('default',)
 PIXEL_ADD_STATE = ('date chosen',)
 PIXEL_EDIT_STATE = ('getting quantity',)
+PIXEL_IMPORT_STATE = ('waiting csv',)
 GRAPH_CREATION_STATE = ('choosing name', 'choosing unit', 'choosing type',
                         'choosing color', 'graph confirmation')
-USERS = {}
+
+
+USERS = UserCache()
 cb = CallbackData('post', 'graph', 'action')
 
 # Commands for bot
-COMMANDS = ['start', 'select', 'create', 'delete']
+COMMANDS = ['start', 'select', 'create', 'delete', 'export']
 BOT_COMMANDS = [
     types.BotCommand('start', 'Найти или создать профиль.'),
     types.BotCommand('select', 'Вывести список таблиц.'),
     types.BotCommand('create', 'Создать новую таблицу.'),
     types.BotCommand('delete', 'Удалить профиль.'),
+    types.BotCommand('export', 'Выгрузить все таблицы в CSV.'),
     # types.BotCommand('exit', 'Выход.')
 ]
 
@@ -130,7 +144,7 @@ async def inline_graph_handler(query: types.CallbackQuery, callback_data: dict):
     :param callback_data: contains graph id and action to filter by.
     """
     user = await get_user(query.from_user.id, USERS)
-    user.graph = await set_graph(query.message, callback_data['graph'], user)
+    user.graph = await set_graph(query.message, callback_data['graph'], user) or EMPTY_GRAPH
     markup = create_markup_list_graphs(callback_data['graph'])
     await save_user(user)
     await query.message.edit_reply_markup(reply_markup=markup)
@@ -147,7 +161,8 @@ async def view_graph(query: types.CallbackQuery, callback_data: dict):
     user = await get_user(query.from_user.id, USERS)
     logger.info('Показываем таблицу %s пользователю %d.', graph_id, user.id)
     try:
-        url = await show_graph(user.session, user.pixela_name, graph_id)
+        url = await show_graph(get_session(), user.pixela_name, graph_id, user.pixela_token,
+                               known=user.graph is not None and user.graph.id == graph_id)
         await query.message.edit_text(f'Ссылка на таблицу:\n{url}')
     except PixelaDataException as exc:
         logger.error('Произошла ошибка %s.', exc)
@@ -172,7 +187,7 @@ async def pixela_graphs_lookup(message: types.Message, user: User):
     await message.reply('Ищем ваши таблицы...')
     logger.info('Ищем таблицы пользователя %d.', user.id)
     try:
-        graphs = await get_graphs(user.session, user.pixela_token, user.pixela_name)
+        graphs = await get_graphs(get_session(), user.pixela_token, user.pixela_name)
         if len(graphs) != 0:
             markup = graphs_info_inline(graphs)
             await message.answer('Ваши таблицы:', reply_markup=markup)
@@ -200,9 +215,12 @@ def create_inline_markup_pixel_action(graph: str) -> types.InlineKeyboardMarkup:
         text='Удалить',
         callback_data=cb.new(graph, 'del_pixel'))
     btn4 = types.InlineKeyboardButton(
+        text='Загрузить CSV',
+        callback_data=cb.new(graph, 'import'))
+    btn5 = types.InlineKeyboardButton(
         text='Назад',
         callback_data=cb.new(graph, 'list'))
-    buttons = [btn1, btn2, btn3, btn4]
+    buttons = [btn1, btn2, btn3, btn4, btn5]
     markup.add(*buttons)
     return markup
 
@@ -225,9 +243,6 @@ async def command_handler(message: types.Message):
     logger.info('User details: %s', user)
     if not user:
         await ask_to_create_user(message)
-    elif not user.session:
-        user.session = aiohttp.ClientSession()
-        await message.answer('Возобновляем сессию, попробуйте еще раз...')
     elif message.text == '/start':
         if user.pixela_name:
             await message.answer(f'Здравствуйте, {user.first_name}! '
@@ -255,6 +270,11 @@ async def command_handler(message: types.Message):
             await message.reply('Вы уверены?')
             user.state = USER_DELETION_STATE[0]
             await save_user(user)
+    elif message.text == '/export':
+        if not user.pixela_name:
+            await message.answer('Сначала создайте профиль.')
+        else:
+            await export_handler(message, user)
 
 
 @dp.message_handler()
@@ -266,9 +286,6 @@ async def main_handler(message: types.Message):
     logger.info('User details: %s', user)
     if not user:
         await ask_to_create_user(message)
-    elif not user.session:
-        user.session = aiohttp.ClientSession()
-        await message.answer('Возобновляем сессию, попробуйте еще раз...')
     elif user.state == USER_CREATION_STATE[0]:
         await user_creation_agreement(message, user)
     elif user.state == USER_CREATION_STATE[1]:
@@ -337,6 +354,7 @@ async def default_message(message: types.Message):
                          '/create - Создать новую таблицу.\n'
                          '/select - Просмотреть доступные таблицы.\n'
                          '/delete - Удалить профиль.\n'
+                         '/export - Выгрузить все таблицы в CSV.\n'
                          '/exit   - Выйти.')
 
 
@@ -348,8 +366,7 @@ async def user_name_selection(message: types.Message, user: User):
     if pattern.match(message.text):
         await message.reply('Проверим...')
         try:
-            user.session = aiohttp.ClientSession()
-            token, username = await create_user(user.session, TOKEN_PIXELA, message.text.lower())
+            token, username = await create_user(get_session(), TOKEN_PIXELA, message.text.lower())
             await message.answer(f'Профиль успешно создан! Ваше имя профиля {username},'
                                  f' токен {token}.')
             logger.info('Pixela profile for user with id %d with username %s created.',
@@ -376,10 +393,10 @@ async def user_delete_handler(message: types.Message, user: User):
     """
     if message.text.lower() == 'да':
         try:
-            await delete_user(user.session, user.pixela_token, user.pixela_name)
+            await delete_user(get_session(), user.pixela_token, user.pixela_name)
             await message.answer('Профиль успешно удален!')
             logger.info('Pixela profile deleted for user with id %d.', user.id)
-            await user.session.close()
+            await uncache_user_pixels(user.id)
             user.reset()
             await save_user(user)
         except PixelaDataException as exc:
@@ -411,11 +428,11 @@ async def graph_creation_unit(message: types.Message, user: User):
     Gets graph name and asks for unit name.
     """
     if message.text:
-        user.graph['name'] = message.text
+        user.graph = user.graph._replace(name=message.text)
         if user.editting:
             await updating_graph(message, user)
         else:
-            if not user.graph['unit']:
+            if not user.graph.unit:
                 await message.reply('Выберите единицы измерения таблицы:')
                 user.state = GRAPH_CREATION_STATE[1]
             else:
@@ -430,11 +447,11 @@ async def graph_creation_type(message: types.Message, user: User):
     Gets graph unit name and asks for type of unit.
     """
     if message.text:
-        user.graph['unit'] = message.text
+        user.graph = user.graph._replace(unit=message.text)
         if user.editting:
             await updating_graph(message, user)
         else:
-            if not user.graph['type']:
+            if not user.graph.type:
                 markup = type_selection()
                 await message.reply('Выберите тип единиц измерения таблицы:', reply_markup=markup)
                 user.state = GRAPH_CREATION_STATE[2]
@@ -466,11 +483,11 @@ async def graph_type_processing(message: types.Message, user: User, type_: str):
     :param user:
     :param type_: float or int
     """
-    user.graph['type'] = type_
+    user.graph = user.graph._replace(type=type_)
     if user.editting:
         await updating_graph(message, user)
     else:
-        if not user.graph['color']:
+        if not user.graph.color:
             markup = color_selection()
             await message.reply('Выберите цвет таблицы:', reply_markup=markup)
             user.state = GRAPH_CREATION_STATE[3]
@@ -510,10 +527,10 @@ async def graph_creation_confirm(message: types.Message, user: User):
     Gets graph color and proceeds to confirming graph creation.
     """
     if message.text in [e.value for e in Color]:
-        user.graph['color'] = Color(message.text).name
+        user.graph = user.graph._replace(color=Color(message.text).name)
     else:
-        user.graph['color'] = None
-    if user.graph["color"]:
+        user.graph = user.graph._replace(color=None)
+    if user.graph.color:
         if user.editting:
             await updating_graph(message, user)
         else:
@@ -527,8 +544,8 @@ async def creation_graph_confirm(message: types.Message, user: User):
     """
     Asks if graph was setted correctly or user wants to change anything.
     """
-    await message.answer(f'Создаем таблицу с именем {user.graph["name"]} '
-                         f'в единицах {user.graph["unit"]} и с цветом {Color[user.graph["color"]].value}. '
+    await message.answer(f'Создаем таблицу с именем {user.graph.name} '
+                         f'в единицах {user.graph.unit} и с цветом {Color[user.graph.color].value}. '
                          f'Все верно?')
     user.state = GRAPH_CREATION_STATE[4]
     await save_user(user)
@@ -541,14 +558,14 @@ async def graph_creation_finish(message: types.Message, user: User):
     if message.text.lower() == 'да':
         await message.reply('Создаем таблицу...')
         try:
-            # Pop id to be able to unpack user.graph
-            user.graph.pop('id')
             id = await create_graph(
-                 user.session,
+                 get_session(),
                  user.pixela_token,
                  user.pixela_name,
-                 **user.graph)
-            user.graph['id'] = id
+                 user.graph.name,
+                 user.graph.unit,
+                 user.graph.type,
+                 user.graph.color)
             await message.answer(f'Успешно создана таблица с id {id}!')
             logger.info('Created graph with id %s for user with id %d.', id, user.id)
             user.state = USER_DEFAULT_STATE[0]
@@ -558,9 +575,6 @@ async def graph_creation_finish(message: types.Message, user: User):
         except PixelaDataException as exc:
             logger.error('Произошла ошибка %s.', exc)
             await message.reply(f'Произошла ошибка {exc}.')
-        finally:
-            if not user.graph.get('id'):
-                user.graph['id'] = None
     elif message.text.lower() == 'нет':
         markup = await edit_graph_inline(None)
         await message.reply('Выберите что изменить:', reply_markup=markup)
@@ -576,15 +590,15 @@ async def updating_graph(message: types.Message, user: User):
     Updates graph with new parameters.
     """
     try:
-        id = await update_graph(user.session, user.pixela_token, user.pixela_name, **user.graph)
-        if user.graph['id'] == id:
+        id = await update_graph(get_session(), user.pixela_token, user.pixela_name, **user.graph._asdict())
+        if user.graph.id == id:
             await message.answer('Таблица успешно обновлена!')
             logger.info('Таблица с id %s пользователя с id %d обновлена.', id, user.id)
         else:
             await message.answer('Произошла внутренняя ошибка, просим прощения. '
                                  'Попробуйте еще раз чуть позже.')
             logger.error('Ошибка в обновлении таблицы. Исходный id %d не совпадает с id %d, полученным от API.',
-                         user.graph['id'], id)
+                         user.graph.id, id)
         user.editting = False
         user.state = USER_DEFAULT_STATE[0]
         user.reset_graph()
@@ -628,12 +642,14 @@ async def edit_handler(query: types.CallbackQuery, callback_data: dict):
     await query.message.edit_text('Редактировать:', reply_markup=markup)
 
 
-async def set_graph(message: types.Message, graph_id: str, user: User):
+async def set_graph(message: types.Message, graph_id: str, user: User) -> Optional[Graph]:
     """
     Helper function to set graph for updating/viewing.
+    :return: graph or None if it could not be loaded, error is already reported to user
     """
     try:
-        return await get_graph(user.session, user.pixela_token, user.pixela_name, graph_id)
+        graph = await get_graph(get_session(), user.pixela_token, user.pixela_name, graph_id)
+        return Graph.from_dict(graph)
     except PixelaDataException as exc:
         logger.error('Произошла ошибка %s.', exc)
         await message.reply(f'Произошла ошибка {exc}.')
@@ -671,12 +687,12 @@ async def edit_unit_handler(query: types.CallbackQuery, callback_data: dict):
 async def edit_type_handler(query: types.CallbackQuery, callback_data: dict):
     """
     Asks for new unit type for graph. Action is permitted only if there are none
-    already existing pixels in current graph.
+    already existing pixels in current graph, so they are checked on Pixela rather than in cache.
     """
     graph = callback_data['graph']
     user = await get_user(query.from_user.id, USERS)
     try:
-        pixels = await get_pixels(user.session, user.pixela_token, user.pixela_name, graph)
+        pixels = await get_pixels(get_session(), user.pixela_token, user.pixela_name, graph, refresh=True)
         if pixels == []:
             markup = type_selection()
             await query.message.reply('Выберите тип единиц измерения таблицы:', reply_markup=markup)
@@ -743,9 +759,10 @@ async def delete_graph_confirm(query: types.CallbackQuery, callback_data: dict):
     user = await get_user(query.from_user.id, USERS)
     await query.message.edit_text('Удаляем таблицу...')
     try:
-        await delete_graph(user.session, user.pixela_token, user.pixela_name, graph)
+        await delete_graph(get_session(), user.pixela_token, user.pixela_name, graph)
         await query.message.answer('Таблица успешно удалена!')
         logger.info('Таблица с id %s пользователя с id %d удалена.', graph, user.id)
+        await uncache_graph(user.id, graph)
         user.state = USER_DEFAULT_STATE[0]
         user.reset_graph()
         await save_user(user)
@@ -814,9 +831,9 @@ async def add_pixel_process_date(message: types.Message, user_id: int, date_: da
     """
     user = await get_user(user_id, USERS)
     date_str = date_to_str(date_)
-    user.pixel['date'] = date_str
+    user.pixel = user.pixel._replace(date=date_str)
     await message.edit_text(f'Вы выбрали {date_.strftime("%d/%m/%Y")}.')
-    await message.answer(f'Выберите количество {user.graph["unit"]}:')
+    await message.answer(f'Выберите количество {user.graph.unit}:')
     user.state = PIXEL_ADD_STATE[0]
     await save_user(user)
 
@@ -825,13 +842,14 @@ async def pixel_post_type(message: types.Message, user: User, type_: str):
     """
     Checks pixel data type and creates pixel.
     """
-    if user.graph['type'] == type_:
+    if user.graph.type == type_:
         try:
-            await post_pixel(user.session, user.pixela_token, user.pixela_name, user.graph['id'],
-                       user.pixel['date'], user.pixel['quantity'])
+            await post_pixel(get_session(), user.pixela_token, user.pixela_name, user.graph.id,
+                       user.pixel.date, user.pixel.quantity)
             await message.answer('Точка успешно добавлена!')
             logger.info('Добавлена точка с датой %s на график с id %s для пользователя с id %d.',
-                        user.pixel['date'], user.graph['id'], user.id)
+                        user.pixel.date, user.graph.id, user.id)
+            await cache_pixel(user.id, user.graph.id, user.pixel.date, user.pixel.quantity)
             user.state = USER_DEFAULT_STATE[0]
             user.reset_pixel()
             user.reset_graph()
@@ -841,7 +859,7 @@ async def pixel_post_type(message: types.Message, user: User, type_: str):
             logger.error('Произошла ошибка %s.', exc)
             await message.answer(f'Произошла ошибка {exc}.')
     else:
-        await message.reply(f'Выберите верный тип данных {user.graph["type"]}.')
+        await message.reply(f'Выберите верный тип данных {user.graph.type}.')
 
 
 async def pixel_quantity_selection(message: types.Message, user: User):
@@ -850,12 +868,12 @@ async def pixel_quantity_selection(message: types.Message, user: User):
     """
     try:
         quantity = int(message.text)
-        user.pixel['quantity'] = quantity
+        user.pixel = user.pixel._replace(quantity=quantity)
         await pixel_post_type(message, user, 'int')
     except ValueError:
         try:
             quantity = float(message.text)
-            user.pixel['quantity'] = quantity
+            user.pixel = user.pixel._replace(quantity=quantity)
             await pixel_post_type(message, user, 'float')
         except ValueError:
             await message.reply('Не понимаю.')
@@ -882,13 +900,16 @@ async def edit_pixel(query: types.CallbackQuery, callback_data: dict):
     graph = callback_data['graph']
     user = await get_user(query.from_user.id, USERS)
     try:
-        pixels = await get_pixels(user.session, user.pixela_token, user.pixela_name, graph)
+        pixels, fetched = await fetch_pixels(get_session(), user.pixela_token, user.pixela_name, graph)
         user.pixels = pixels
         markup = await load_pixels(pixels, user, action='edit')
         if not markup:
             await query.message.edit_text('Нет доступных точек.')
         else:
             await query.message.edit_text('Выберите точку для изменения:', reply_markup=markup)
+        # Pixels from cache of Pixela client are already in database cache
+        if fetched:
+            await cache_pixels(user.id, graph, pixels)
         await save_user(user)
     except PixelaDataException as exc:
         logger.error('Произошла ошибка %s.', exc)
@@ -902,7 +923,7 @@ async def pixel_edit_ask_quantity(query: types.CallbackQuery, callback_data: dic
     """
     pixel = callback_data['pixel']
     user = await get_user(query.from_user.id, USERS)
-    user.pixel['date'] = pixel
+    user.pixel = user.pixel._replace(date=pixel)
     user.state = PIXEL_EDIT_STATE[0]
     await save_user(user)
     await query.message.answer('Выберите новое значение точки:')
@@ -913,14 +934,15 @@ async def edit_pixel_helper(message: types.Message, user: User,
     """
     Updates pixel.
     """
-    if user.graph['type'] == type_:
+    if user.graph.type == type_:
         try:
-            await update_pixel(user.session, user.pixela_token, user.pixela_name,
-                         user.graph['id'], user.pixel['date'], quantity)
+            await update_pixel(get_session(), user.pixela_token, user.pixela_name,
+                         user.graph.id, user.pixel.date, quantity)
             await message.answer('Точка успешно обновлена!')
             user.state = USER_DEFAULT_STATE[0]
             logger.info('Точка с датой %s таблицы с id %s пользователя с id %d обновлена.',
-                        user.pixel['date'], user.graph['id'], user.id)
+                        user.pixel.date, user.graph.id, user.id)
+            await cache_pixel(user.id, user.graph.id, user.pixel.date, quantity)
             user.reset_pixel()
             user.reset_graph()
             await save_user(user)
@@ -929,7 +951,7 @@ async def edit_pixel_helper(message: types.Message, user: User,
             logger.error('Произошла ошибка %s.', exc)
             await message.answer(f'Произошла ошибка {exc}.')
     else:
-        await message.reply(f'Выберите верный тип данных {user.graph["type"]}.')
+        await message.reply(f'Выберите верный тип данных {user.graph.type}.')
 
 
 async def edit_pixel_confirm(message: types.Message, user: User):
@@ -958,13 +980,16 @@ async def del_pixel(query: types.CallbackQuery, callback_data: dict):
     graph = callback_data['graph']
     user = await get_user(query.from_user.id, USERS)
     try:
-        pixels = await get_pixels(user.session, user.pixela_token, user.pixela_name, graph)
+        pixels, fetched = await fetch_pixels(get_session(), user.pixela_token, user.pixela_name, graph)
         user.pixels = pixels
         markup = await load_pixels(pixels, user, action='delete')
         if not markup:
             await query.message.edit_text('Нет доступных точек.')
         else:
             await query.message.edit_text('Выберите точку для удаления:', reply_markup=markup)
+        # Pixels from cache of Pixela client are already in database cache
+        if fetched:
+            await cache_pixels(user.id, graph, pixels)
         await save_user(user)
     except PixelaDataException as exc:
         logger.error('Произошла ошибка %s.', exc)
@@ -979,10 +1004,11 @@ async def pixel_delete_confirm(query: types.CallbackQuery, callback_data: dict):
     pixel = callback_data['pixel']
     user = await get_user(query.from_user.id, USERS)
     try:
-        await delete_pixel(user.session, user.pixela_token, user.pixela_name, user.graph['id'], pixel)
+        await delete_pixel(get_session(), user.pixela_token, user.pixela_name, user.graph.id, pixel)
         await query.message.answer('Точка успешно удалена!')
         logger.info('Точка с датой %s таблицы с id %s пользователя с id %d удалена.',
-                    pixel, user.graph['id'], user.id)
+                    pixel, user.graph.id, user.id)
+        await uncache_pixel(user.id, user.graph.id, pixel)
         user.state = USER_DEFAULT_STATE[0]
         user.reset_pixel()
         user.reset_graph()
@@ -993,6 +1019,114 @@ async def pixel_delete_confirm(query: types.CallbackQuery, callback_data: dict):
         await query.message.answer(f'Произошла ошибка {exc}.')
 
 
+# ------------- Export pixels -------------
+
+
+async def export_handler(message: types.Message, user: User):
+    """
+    Writes all graphs and pixels of user into temporary csv file and sends it as document.
+    """
+    if not export_limiter.acquire(user.id):
+        await message.answer('Выгрузка уже выполняется, дождитесь её окончания.')
+        return
+    try:
+        await message.answer('Выгружаем таблицы...')
+        with tempfile.TemporaryFile() as file:
+            text = io.TextIOWrapper(file, encoding='utf-8', newline='')
+            rows = await write_export(PixelaClient(get_session(), user.pixela_token, user.pixela_name), text)
+            text.flush()
+            file.seek(0)
+            if rows:
+                await message.answer_document(types.InputFile(file, filename=f'{user.pixela_name}.csv'),
+                                              caption=f'Выгружено точек: {rows}.')
+            else:
+                await message.answer('Точек для выгрузки нет.')
+            text.detach()
+        logger.info('Выгружено %d точек пользователя с id %d.', rows, user.id)
+    except PixelaDataException as exc:
+        logger.error('Произошла ошибка %s.', exc)
+        await message.answer(f'Произошла ошибка {exc}.')
+    finally:
+        export_limiter.release(user.id)
+
+
+# ------------- Import pixels -------------
+
+
+@dp.callback_query_handler(cb.filter(action='import'))
+async def import_pixels_ask_file(query: types.CallbackQuery, callback_data: dict):
+    """
+    Asks for csv file with pixels for chosen graph.
+    """
+    user = await get_user(query.from_user.id, USERS)
+    graph = await set_graph(query.message, callback_data['graph'], user)
+    if graph is None:
+        return
+    user.graph = graph
+    user.state = PIXEL_IMPORT_STATE[0]
+    await save_user(user)
+    await query.message.edit_text('Отправьте CSV файл, в каждой строке которого дата (ГГГГММДД) '
+                                  f'и количество {user.graph.unit} типа {user.graph.type}.')
+
+
+@dp.message_handler(content_types=types.ContentType.DOCUMENT)
+async def import_pixels_handler(message: types.Message):
+    """
+    Validates received csv file and uploads its pixels to chosen graph in batches, reporting progress.
+    """
+    user = await get_user(message.from_user.id, USERS)
+    if not user or user.state != PIXEL_IMPORT_STATE[0]:
+        await message.reply('Не понимаю.')
+        return
+    if message.document.file_size > IMPORT_MAX_FILE_SIZE:
+        await message.reply(f'Файл больше {IMPORT_MAX_FILE_SIZE // 1024} КБ.')
+        return
+    content = await message.document.download(destination_file=io.BytesIO())
+    try:
+        text = content.getvalue().decode('utf-8-sig')
+    except UnicodeDecodeError:
+        await message.reply('Файл должен быть в кодировке UTF-8.')
+        return
+    pixels, errors = parse_pixels_csv(text, user.graph.type)
+    if errors:
+        await message.reply('Файл не загружен, исправьте ошибки и отправьте его снова:\n'
+                            + '\n'.join(errors[:IMPORT_MAX_ERRORS]))
+        return
+    if not pixels:
+        await message.reply('В файле нет точек.')
+        return
+    status = await message.answer(f'Загружено 0 из {len(pixels)} точек.')
+    last_update = time.monotonic()
+
+    async def progress(uploaded: int):
+        nonlocal last_update
+        # Telegram limits edits of a message, so progress is shown at most once a second
+        if time.monotonic() - last_update >= 1 and uploaded < len(pixels):
+            last_update = time.monotonic()
+            await status.edit_text(f'Загружено {uploaded} из {len(pixels)} точек.')
+
+    uploaded, exc = await upload_pixels(PixelaClient(get_session(), user.pixela_token, user.pixela_name),
+                                        user.graph.id, pixels, progress)
+    logger.info('Загружено %d из %d точек на график с id %s для пользователя с id %d.',
+                uploaded, len(pixels), user.graph.id, user.id)
+    if exc is not None:
+        logger.error('Произошла ошибка %s.', exc)
+        await status.edit_text(f'Загружено {uploaded} из {len(pixels)} точек. Произошла ошибка {exc}.')
+    else:
+        await status.edit_text(f'Загружено {uploaded} из {len(pixels)} точек.')
+    try:
+        await cache_pixels(user.id, user.graph.id,
+                           await get_pixels(get_session(), user.pixela_token, user.pixela_name,
+                                            user.graph.id, refresh=True))
+    except PixelaDataException as exc:
+        logger.error('Произошла ошибка %s.', exc)
+    user.state = USER_DEFAULT_STATE[0]
+    user.pixels = None
+    user.reset_graph()
+    await save_user(user)
+    await default_message(message)
+
+
 async def on_startup(dispatcher):
     """
     Function on bot startup.
@@ -1004,7 +1138,26 @@ async def on_startup(dispatcher):
     await bot.set_my_commands(BOT_COMMANDS)
     menu_button = types.MenuButtonCommands()
     await bot.set_chat_menu_button(menu_button=menu_button)
+    get_session()
     await database.connect()
+    await listen_users_changes(USERS)
+    user_writer.start()
+    if WARMUP_USERS:
+        # Bot is serving while users are loading, missing ones are loaded on demand
+        asyncio.ensure_future(warmup_users(USERS))
+
+
+async def metrics_handler(request: web.Request) -> web.Response:
+    """
+    Serves timings of database queries, counters of users, graphs and pixels caches,
+    Pixela retries, rate limiting, coalesced requests and circuit breaker.
+    :param request: http request
+    :return: json response
+    """
+    return web.json_response({'queries': query_metrics.snapshot(), 'users_cache': USERS.stats(),
+                              'pixela_retries': retry_policy.stats, 'pixela_rate_limit': rate_limiter.stats(),
+                              'pixela_graphs': graph_cache.stats(), 'pixela_pixels': pixel_cache.stats(),
+                              'pixela_singleflight': singleflight.stats(), 'pixela_breaker': circuit_breaker.stats()})
 
 
 async def on_shutdown(dispatcher):
@@ -1013,10 +1166,10 @@ async def on_shutdown(dispatcher):
     :param dispatcher:
     :return:
     """
+    await user_writer.stop()
     await database.close()
-    for user in USERS.values():
-        if user.session:
-            await user.session.close()
+    logger.info('Query metrics: %s', query_metrics.snapshot())
+    await close_session()
     if HEROKU:
         await bot.delete_webhook()
 
@@ -1030,6 +1183,9 @@ if __name__ == '__main__':
         executor.start_polling(dp, skip_updates=True,
                                on_startup=on_startup, on_shutdown=on_shutdown)
     else:
-        start_webhook(dispatcher=dp, webhook_path=WEBHOOK_PATH, skip_updates=True,
-                      on_startup=on_startup, on_shutdown=on_shutdown,
-                      host=WEBAPP_HOST, port=WEBAPP_PORT)
+        web_app = web.Application()
+        if METRICS_TOKEN:
+            web_app.router.add_get(METRICS_PATH, metrics_handler)
+        webhook_executor = set_webhook(dispatcher=dp, webhook_path=WEBHOOK_PATH, skip_updates=True,
+                                       on_startup=on_startup, on_shutdown=on_shutdown, web_app=web_app)
+        webhook_executor.run_app(host=WEBAPP_HOST, port=WEBAPP_PORT)
@@ -0,0 +1,129 @@
+"""
+Module to import pixels of a graph from csv file sent to bot.
+"""
+
+import asyncio
+import csv
+import io
+import math
+import os
+from datetime import datetime
+from typing import List, Tuple, Callable, Awaitable, Optional
+
+from pixela import Pixels, PixelaDataException, PixelaClient
+
+# Largest csv file accepted for import, in bytes
+IMPORT_MAX_FILE_SIZE = int(os.getenv('IMPORT_MAX_FILE_SIZE', default=1024 * 1024))
+# Largest number of pixels in one imported file
+IMPORT_MAX_ROWS = int(os.getenv('IMPORT_MAX_ROWS', default=5000))
+# Pixels sent to Pixela in one batch request
+IMPORT_BATCH_SIZE = int(os.getenv('IMPORT_BATCH_SIZE', default=100))
+# Batch requests of one import running at the same time
+IMPORT_CONCURRENCY = int(os.getenv('IMPORT_CONCURRENCY', default=3))
+# Number of invalid rows reported back to user
+IMPORT_MAX_ERRORS = 10
+DATE_FORMATS = ('%Y%m%d', '%Y-%m-%d', '%d.%m.%Y', '%d/%m/%Y')
+
+
+def parse_date(value: str) -> Optional[str]:
+    """
+    Parses date in one of accepted formats.
+    :param value: date from csv cell
+    :return: date in yyyyMMdd format or none if date is invalid
+    """
+    for format_ in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, format_).strftime('%Y%m%d')
+        except ValueError:
+            continue
+    return None
+
+
+def parse_quantity(value: str, type_: str) -> Optional[str]:
+    """
+    Checks quantity against type of graph.
+    :param value: quantity from csv cell
+    :param type_: int or float
+    :return: quantity as sent to Pixela or none if quantity is invalid
+    """
+    try:
+        if type_ == 'int':
+            return str(int(value))
+        quantity = float(value.replace(',', '.'))
+    except ValueError:
+        return None
+    # Pixela rejects nan and infinity, and with them the whole batch
+    return str(quantity) if math.isfinite(quantity) else None
+
+
+def parse_pixels_csv(text: str, type_: str) -> Tuple[List[Pixels], List[str]]:
+    """
+    Reads pixels from csv with date and quantity columns in one pass.
+    Header row is skipped, later rows with the same date replace earlier ones.
+    :param text: content of csv file
+    :param type_: type of graph quantities, int or float
+    :return: valid pixels sorted by date and descriptions of invalid rows
+    """
+    try:
+        dialect = csv.Sniffer().sniff(text[:1024], delimiters=',;\t')
+    except csv.Error:
+        dialect = csv.excel
+    pixels = {}
+    errors = []
+    for number, row in enumerate(csv.reader(io.StringIO(text), dialect), start=1):
+        row = [cell.strip() for cell in row]
+        if not any(row):
+            continue
+        if len(row) < 2:
+            errors.append(f'Строка {number}: нужны дата и количество.')
+            continue
+        date_ = parse_date(row[0])
+        if date_ is None:
+            if number == 1:
+                continue
+            errors.append(f'Строка {number}: неверная дата {row[0]}.')
+            continue
+        quantity = parse_quantity(row[1], type_)
+        if quantity is None:
+            errors.append(f'Строка {number}: количество {row[1]} не типа {type_}.')
+            continue
+        pixels[date_] = quantity
+        if len(pixels) > IMPORT_MAX_ROWS:
+            errors.append(f'В файле больше {IMPORT_MAX_ROWS} точек.')
+            break
+    return [Pixels(date=date_, quantity=pixels[date_]) for date_ in sorted(pixels)], errors
+
+
+async def upload_pixels(client: PixelaClient, graph_id: str, pixels: List[Pixels],
+                        progress: Callable[[int], Awaitable[None]] = None,
+                        batch_size: int = IMPORT_BATCH_SIZE,
+                        concurrency: int = IMPORT_CONCURRENCY) -> Tuple[int, Optional[PixelaDataException]]:
+    """
+    Posts pixels to Pixela in batches, several batches at a time.
+    Batches keep going after one of them fails, so everything that can be imported is.
+    :param client: Pixela client of user
+    :param graph_id:
+    :param pixels: validated pixels
+    :param progress: called with number of uploaded pixels after each batch
+    :param batch_size: pixels in one request
+    :param concurrency: requests running at the same time
+    :return: number of uploaded pixels and first error if any batch failed
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    uploaded = 0
+
+    async def upload(batch: List[Pixels]):
+        nonlocal uploaded
+        async with semaphore:
+            uploaded += await client.post_pixels(graph_id, batch)
+            if progress is not None:
+                await progress(uploaded)
+
+    batches = [pixels[i:i + batch_size] for i in range(0, len(pixels), batch_size)]
+    results = await asyncio.gather(*(upload(batch) for batch in batches), return_exceptions=True)
+    for result in results:
+        if isinstance(result, PixelaDataException):
+            return uploaded, result
+        if isinstance(result, BaseException):
+            raise result
+    return uploaded, None
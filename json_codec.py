@@ -0,0 +1,20 @@
+"""
+Module with json encoder and decoder shared by Pixela client and storage, using orjson if it is installed.
+"""
+
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+if orjson:
+    def json_dumps(obj) -> str:
+        return orjson.dumps(obj).decode()
+
+    json_loads = orjson.loads
+else:
+    json_dumps = json.dumps
+    json_loads = json.loads
@@ -2,14 +2,17 @@
 Module to display created pixels as dates inside calendar, which is shown as inline keyboard.
 """
 
-from datetime import date
-from typing import Optional, List
+from datetime import date, timedelta
+from typing import Optional, List, Tuple
 from aiogram import types
 from aiogram.utils.callback_data import CallbackData
-from utils import User, str_to_date, get_user, date_to_str
-from pixela import Pixels
+from utils import User, str_to_date, get_user, date_to_str, get_cached_month
+from pixela import Pixels, PixelaDataException, get_pixels, get_session
 
 ROW_WIDTH = 4
+# Months of pixels requested from Pixela at once when calendar is moved,
+# one more than displayed so that it is known whether to show arrow further
+WINDOW_MONTHS = 2
 
 cb_calendar = CallbackData('calendar', 'date', 'action', 'direction')
 cb_pixel = CallbackData('pixels', 'pixel', 'action')
@@ -38,7 +41,7 @@ async def load_pixels(pixels: List[Pixels], user: User,
         for pixel_fmt in pixels_sorted:
             if last_date <= pixel_fmt['date'] <= ini_date:
                 btn = create_inline_btn_for_date(pixel_fmt['date'], pixel_fmt["quantity"],
-                                                 user.graph["unit"], action)
+                                                 user.graph.unit, action)
                 buttons.append(btn)
             else:
                 markup.insert(create_inline_btn_for_direction(last_date, 'prev', action))
@@ -62,9 +65,16 @@ async def load_pixel_prev(query: types.CallbackQuery, callback_data: dict, users
     action = callback_data['action']
     cur_month = str_to_date(callback_data['date'])
     user = await get_user(query.from_user.id, users)
-    pixels_sorted = convert_pixel_str_to_date(user.pixels)
+    try:
+        pixels_sorted = convert_pixel_str_to_date(await get_calendar_pixels(user, cur_month, 'prev'))
+    except PixelaDataException as exc:
+        await query.message.answer(f'Произошла ошибка {exc}.')
+        return
     pixels_sorted = sorted([pix for pix in pixels_sorted if pix['date'] < cur_month],
                            key=lambda pix: pix['date'], reverse=True)
+    if not pixels_sorted:
+        await query.answer('Более ранних точек нет.')
+        return
     ini_date = pixels_sorted[0]['date']
     last_date = date(year=ini_date.year, month=ini_date.month, day=1)
     month = last_date.strftime('%B')
@@ -82,7 +92,7 @@ async def load_pixel_prev(query: types.CallbackQuery, callback_data: dict, users
     for pixel_fmt in pixels_sorted:
         if last_date <= pixel_fmt['date'] <= ini_date:
             btn = create_inline_btn_for_date(pixel_fmt['date'], pixel_fmt["quantity"],
-                                             user.graph["unit"], action)
+                                             user.graph.unit, action)
             buttons.append(btn)
         else:
             dir_btn.append(create_inline_btn_for_direction(last_date, 'prev', action))
@@ -108,9 +118,16 @@ async def load_pixel_next(query: types.CallbackQuery, callback_data: dict, users
     action = callback_data['action']
     cur_month = str_to_date(callback_data['date'])
     user = await get_user(query.from_user.id, users)
-    pixels_sorted = convert_pixel_str_to_date(user.pixels)
+    try:
+        pixels_sorted = convert_pixel_str_to_date(await get_calendar_pixels(user, cur_month, 'next'))
+    except PixelaDataException as exc:
+        await query.message.answer(f'Произошла ошибка {exc}.')
+        return
     pixels_sorted = sorted([pix for pix in pixels_sorted if pix['date'] >= cur_month],
                            key=lambda pix: pix['date'])
+    if not pixels_sorted:
+        await query.answer('Более поздних точек нет.')
+        return
     ini_date = pixels_sorted[0]['date']
     if ini_date.month != 12:
         last_date = date(year=ini_date.year, month=ini_date.month + 1, day=1)
@@ -126,7 +143,7 @@ async def load_pixel_next(query: types.CallbackQuery, callback_data: dict, users
     for pixel_fmt in pixels_sorted:
         if ini_date <= pixel_fmt['date'] < last_date:
             btn = create_inline_btn_for_date(pixel_fmt['date'], pixel_fmt["quantity"],
-                                             user.graph["unit"], action)
+                                             user.graph.unit, action)
             buttons.append(btn)
         else:
             if ini_date.month != 12:
@@ -140,6 +157,52 @@ async def load_pixel_next(query: types.CallbackQuery, callback_data: dict, users
     await query.message.edit_reply_markup(reply_markup=markup)
 
 
+async def get_calendar_pixels(user: User, cur_month: date, direction: str) -> List[Pixels]:
+    """
+    Gets pixels for calendar from user object, or only needed month from database cache
+    if they are not loaded (e.g. after restart). If database has none, window of months
+    in given direction is requested from Pixela, in case database cache lags behind it,
+    and whole history if the window does not tell what lies beyond it.
+    :param user:
+    :param cur_month: first day of month to look from
+    :param direction: prev or next
+    :return: list of pixels
+    """
+    if user.pixels is not None:
+        return user.pixels
+    pixels = await get_cached_month(user.id, user.graph.id, cur_month, direction)
+    if pixels:
+        return pixels
+    from_, to = calendar_window(cur_month, direction)
+    pixels = await get_pixels(get_session(), user.pixela_token, user.pixela_name, user.graph.id,
+                              from_=date_to_str(from_), to=date_to_str(to))
+    # Window settles the nearest month and the arrow beyond it only if it has pixels of two months,
+    # otherwise gap between pixels may be longer than window and whole history is needed
+    if len({pixel['date'][:6] for pixel in pixels}) >= 2:
+        return pixels
+    return await get_pixels(get_session(), user.pixela_token, user.pixela_name, user.graph.id)
+
+
+def add_months(date_: date, months: int) -> date:
+    """
+    Gets first day of month which is given number of months away from date.
+    """
+    month = date_.year * 12 + date_.month - 1 + months
+    return date(year=month // 12, month=month % 12 + 1, day=1)
+
+
+def calendar_window(cur_month: date, direction: str) -> Tuple[date, date]:
+    """
+    Gets first and last dates of months before or starting from given month.
+    :param cur_month: first day of month
+    :param direction: prev or next
+    :return: first and last date
+    """
+    if direction == 'prev':
+        return add_months(cur_month, -WINDOW_MONTHS), cur_month - timedelta(days=1)
+    return cur_month, add_months(cur_month, WINDOW_MONTHS) - timedelta(days=1)
+
+
 def convert_pixel_str_to_date(pixels: List[Pixels]) -> List:
     """
     Turns dates in str format to date format inside pixel's dict.
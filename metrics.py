@@ -0,0 +1,116 @@
+"""
+Module collecting latency of database queries: histograms, percentiles and slow query log.
+"""
+
+import bisect
+import logging
+import os
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, Iterator
+
+# Queries running longer than this number of milliseconds are logged
+SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', default=200))
+# Number of latest timings kept per statement for percentiles
+QUERY_SAMPLES = int(os.getenv('QUERY_SAMPLES', default=1000))
+# Upper bounds of histogram buckets in milliseconds, the last bucket takes the rest
+LATENCY_BUCKETS_MS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+logger = logging.getLogger(__name__)
+
+
+class QueryStats:
+    """
+    Timings of one statement.
+    """
+
+    __slots__ = ('count', 'errors', 'total', 'max', 'buckets', 'samples')
+
+    def __init__(self, samples: int = QUERY_SAMPLES):
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.samples = deque(maxlen=samples)
+
+    def add(self, ms: float, failed: bool = False):
+        self.count += 1
+        self.errors += failed
+        self.total += ms
+        self.max = max(self.max, ms)
+        self.buckets[bisect.bisect_left(LATENCY_BUCKETS_MS, ms)] += 1
+        self.samples.append(ms)
+
+    def percentile(self, q: float) -> float:
+        """
+        Gets percentile of latest timings.
+        :param q: percentile from 0 to 100
+        :return: timing in milliseconds
+        """
+        if not self.samples:
+            return 0.0
+        samples = sorted(self.samples)
+        return samples[min(int(len(samples) * q / 100), len(samples) - 1)]
+
+    def snapshot(self) -> dict:
+        histogram = {f'le_{bound:g}': count for bound, count in zip(LATENCY_BUCKETS_MS, self.buckets)}
+        histogram['inf'] = self.buckets[-1]
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'avg_ms': round(self.total / self.count, 3) if self.count else 0.0,
+            'max_ms': round(self.max, 3),
+            'p50_ms': round(self.percentile(50), 3),
+            'p95_ms': round(self.percentile(95), 3),
+            'p99_ms': round(self.percentile(99), 3),
+            'histogram': histogram,
+        }
+
+
+class QueryMetrics:
+    """
+    Timings of queries by statement name.
+    """
+
+    def __init__(self, slow_query_ms: float = SLOW_QUERY_MS, samples: int = QUERY_SAMPLES):
+        self.slow_query_ms = slow_query_ms
+        self.samples = samples
+        self.stats: Dict[str, QueryStats] = {}
+
+    def observe(self, name: str, ms: float, failed: bool = False):
+        """
+        Records timing of a query, logging it if it is slow.
+        :param name: statement name
+        :param ms: duration in milliseconds
+        :param failed: whether query raised an error
+        """
+        stats = self.stats.get(name)
+        if stats is None:
+            stats = self.stats[name] = QueryStats(self.samples)
+        stats.add(ms, failed)
+        if ms >= self.slow_query_ms:
+            logger.warning('Slow query %s took %.1f ms.', name, ms)
+
+    @contextmanager
+    def timer(self, name: str) -> Iterator[None]:
+        """
+        Measures the wrapped block as a query with given statement name.
+        """
+        start = time.perf_counter()
+        failed = True
+        try:
+            yield
+            failed = False
+        finally:
+            self.observe(name, (time.perf_counter() - start) * 1000, failed)
+
+    def snapshot(self) -> dict:
+        return {name: stats.snapshot() for name, stats in self.stats.items()}
+
+    def reset(self):
+        self.stats.clear()
+
+
+query_metrics = QueryMetrics()
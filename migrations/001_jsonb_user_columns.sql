@@ -0,0 +1,5 @@
+-- Store graph, pixel and pixels as native jsonb, old 'null' strings become SQL NULL.
+ALTER TABLE users
+    ALTER COLUMN graph TYPE jsonb USING NULLIF(graph::text, 'null')::jsonb,
+    ALTER COLUMN pixel TYPE jsonb USING NULLIF(pixel::text, 'null')::jsonb,
+    ALTER COLUMN pixels TYPE jsonb USING NULLIF(pixels::text, 'null')::jsonb;
@@ -0,0 +1,10 @@
+-- Pixels of graphs are cached in their own table instead of one json blob inside users row.
+CREATE TABLE IF NOT EXISTS pixels_cache (
+    telegram_id bigint NOT NULL,
+    graph_id text NOT NULL,
+    date date NOT NULL,
+    quantity text NOT NULL,
+    PRIMARY KEY (telegram_id, graph_id, date)
+);
+
+ALTER TABLE users DROP COLUMN IF EXISTS pixels;
@@ -0,0 +1,22 @@
+-- Users are upserted by telegram_id, so it has to be unique. The table has no timestamps to tell
+-- which duplicate was written last, so keep the one with pixela profile, and among equal ones
+-- the one at the highest physical position.
+DELETE FROM users
+WHERE ctid IN (
+    SELECT ctid FROM (
+        SELECT ctid, row_number() OVER (
+            PARTITION BY telegram_id ORDER BY (pixela_name IS NOT NULL) DESC, ctid DESC
+        ) AS position
+        FROM users
+    ) AS ranked
+    WHERE position > 1
+);
+
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conrelid = 'users'::regclass AND contype = 'p') THEN
+        ALTER TABLE users ADD PRIMARY KEY (telegram_id);
+    ELSE
+        CREATE UNIQUE INDEX IF NOT EXISTS users_telegram_id_key ON users (telegram_id);
+    END IF;
+END $$;
@@ -2,15 +2,23 @@
 Module for working with external Pixela API.
 """
 
+import asyncio
 import enum
-import json
+import logging
+import random
+import time
+from collections import OrderedDict
+from functools import partial
 from datetime import datetime
 import re
 import os
-from typing import Tuple, Union, List, Optional, Literal, TypedDict
+from typing import Tuple, Union, List, Optional, Literal, TypedDict, Callable, Any, Awaitable, Dict
 import requests
 import aiohttp
 
+from metrics import QueryStats
+from json_codec import json_dumps, json_loads
+
 PIXELA_BASE_URL = 'https://pixe.la/v1/'
 HEROKU = os.getenv('HEROKU', False)
 if HEROKU:
@@ -19,6 +27,52 @@ if HEROKU:
 else:
     from config import TOKEN_PIXELA, NAME_PREFIX
 
+# Settings of connection pool shared by all requests to Pixela
+PIXELA_CONNECTION_LIMIT = int(os.getenv('PIXELA_CONNECTION_LIMIT', default=100))
+PIXELA_KEEPALIVE_TIMEOUT = float(os.getenv('PIXELA_KEEPALIVE_TIMEOUT', default=30))
+PIXELA_DNS_CACHE_TTL = int(os.getenv('PIXELA_DNS_CACHE_TTL', default=300))
+PIXELA_REQUEST_TIMEOUT = float(os.getenv('PIXELA_REQUEST_TIMEOUT', default=30))
+# Retries of rejected and failed requests, delays grow exponentially with random jitter
+PIXELA_RETRY_ATTEMPTS = int(os.getenv('PIXELA_RETRY_ATTEMPTS', default=5))
+PIXELA_RETRY_BASE_DELAY = float(os.getenv('PIXELA_RETRY_BASE_DELAY', default=0.2))
+PIXELA_RETRY_MAX_DELAY = float(os.getenv('PIXELA_RETRY_MAX_DELAY', default=2))
+# Seconds a request may take with all its retries
+PIXELA_RETRY_BUDGET = float(os.getenv('PIXELA_RETRY_BUDGET', default=10))
+# Seconds one attempt of request may take, by endpoint of Pixela API
+PIXELA_ENDPOINT_TIMEOUTS = {
+    'users': float(os.getenv('PIXELA_USERS_TIMEOUT', default=10)),
+    'graphs': float(os.getenv('PIXELA_GRAPHS_TIMEOUT', default=5)),
+    'pixel': float(os.getenv('PIXELA_PIXEL_TIMEOUT', default=5)),
+    'pixels': float(os.getenv('PIXELA_PIXELS_TIMEOUT', default=10)),
+    'page': float(os.getenv('PIXELA_PAGE_TIMEOUT', default=5)),
+}
+# Consecutive failures after which Pixela is considered down and requests fail at once, 0 disables it,
+# and seconds until a single request is let through to check whether Pixela is back
+PIXELA_BREAKER_FAILURES = int(os.getenv('PIXELA_BREAKER_FAILURES', default=5))
+PIXELA_BREAKER_RESET = float(os.getenv('PIXELA_BREAKER_RESET', default=30))
+# Statuses meaning request was not processed, safe to repeat for any method
+REJECTED_STATUSES = frozenset((429, 503))
+# Statuses after which request may have been processed, repeated only for idempotent methods
+RETRY_STATUSES = frozenset((500, 502, 504))
+# Methods safe to repeat when it is unknown whether request reached Pixela
+IDEMPOTENT_METHODS = frozenset(('GET', 'HEAD', 'PUT', 'DELETE'))
+# Methods whose identical concurrent requests share one request to Pixela
+COALESCED_METHODS = frozenset(('GET', 'HEAD'))
+# Requests per second and burst sizes of all requests and of requests of one Pixela user, 0 disables limit
+PIXELA_RATE_LIMIT = float(os.getenv('PIXELA_RATE_LIMIT', default=20))
+PIXELA_RATE_BURST = int(os.getenv('PIXELA_RATE_BURST', default=40))
+PIXELA_USER_RATE_LIMIT = float(os.getenv('PIXELA_USER_RATE_LIMIT', default=2))
+PIXELA_USER_RATE_BURST = int(os.getenv('PIXELA_USER_RATE_BURST', default=5))
+# Number of per user buckets after which idle ones are dropped
+PIXELA_RATE_LIMIT_KEYS = int(os.getenv('PIXELA_RATE_LIMIT_KEYS', default=10000))
+# Seconds graph definitions of a user are served from cache, and number of users kept there
+PIXELA_GRAPHS_TTL = float(os.getenv('PIXELA_GRAPHS_TTL', default=300))
+PIXELA_GRAPHS_CACHE_SIZE = int(os.getenv('PIXELA_GRAPHS_CACHE_SIZE', default=10000))
+# Seconds pixels of a graph are served from cache since they were loaded, and number of graphs kept there
+PIXELA_PIXELS_TTL = float(os.getenv('PIXELA_PIXELS_TTL', default=600))
+PIXELA_PIXELS_CACHE_SIZE = int(os.getenv('PIXELA_PIXELS_CACHE_SIZE', default=1000))
+
+_session: Optional[aiohttp.ClientSession] = None
 
 class Pixels(TypedDict):
     """
@@ -34,6 +88,16 @@ class PixelaDataException(Exception):
     """
 
 
+class PixelaUnavailableException(PixelaDataException):
+    """
+    Pixela could not be reached or is considered down.
+    Message is shown to users as is, completing 'Произошла ошибка ...' of handlers.
+    """
+
+
+UNAVAILABLE_MESSAGE = 'соединения с Pixela'
+
+
 class Color(enum.Enum):
     """
     Class representing available colors as enumerations.
@@ -46,6 +110,557 @@ class Color(enum.Enum):
     kuro = "черный"
 
 
+COLOR_NAMES = frozenset(Color.__members__)
+GRAPH_TYPES = frozenset(('int', 'float'))
+
+logger = logging.getLogger(__name__)
+
+
+class RetryPolicy:
+    """
+    Repeats requests which Pixela rejected or failed to answer, with exponential backoff and jitter,
+    as long as they fit into latency budget. Pixela rejects a share of requests of non-supporter accounts
+    with isRejected flag, such requests are not processed and are safe to repeat for any method.
+    """
+
+    def __init__(self, attempts: int = PIXELA_RETRY_ATTEMPTS, base_delay: float = PIXELA_RETRY_BASE_DELAY,
+                 max_delay: float = PIXELA_RETRY_MAX_DELAY, budget: float = PIXELA_RETRY_BUDGET):
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.budget = budget
+        self.stats = {'requests': 0, 'retries': 0, 'recovered': 0, 'exhausted': 0}
+
+    @staticmethod
+    def is_retryable(method: str, status: int, response: Optional[dict]) -> bool:
+        if status in REJECTED_STATUSES or (response and response.get('isRejected')):
+            return True
+        return status in RETRY_STATUSES and method in IDEMPOTENT_METHODS
+
+    def delay(self, attempt: int) -> float:
+        """
+        Gets random delay before next attempt, up to exponentially growing limit.
+        """
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    async def run(self, method: str,
+                  send: Callable[[float], Awaitable[Tuple[int, Optional[dict]]]],
+                  timeout: float = PIXELA_REQUEST_TIMEOUT) -> Tuple[int, Optional[dict]]:
+        """
+        Sends request, repeating it while response is retryable.
+        :param method: http method
+        :param send: function sending request with given timeout and returning status and decoded response
+        :param timeout: seconds one attempt may take
+        :return: status and decoded response of the last attempt
+        :raises PixelaUnavailableException: if Pixela could not be reached within budget
+        """
+        self.stats['requests'] += 1
+        start = time.monotonic()
+        attempt = 0
+        while True:
+            attempt += 1
+            error = None
+            status, response = 0, None
+            attempt_timeout = max(min(self.budget - (time.monotonic() - start), timeout), 0.1)
+            try:
+                status, response = await send(attempt_timeout)
+                retryable = self.is_retryable(method, status, response)
+            except aiohttp.ClientConnectorError as exc:
+                # Connection was not established, so request was not sent
+                retryable, error = True, exc
+            except (asyncio.TimeoutError, aiohttp.ClientError) as exc:
+                retryable, error = method in IDEMPOTENT_METHODS, exc
+                if not retryable:
+                    raise PixelaUnavailableException(UNAVAILABLE_MESSAGE) from exc
+            if not retryable:
+                if attempt > 1:
+                    self.stats['recovered'] += 1
+                return status, response
+            delay = self.delay(attempt)
+            if attempt >= self.attempts or time.monotonic() - start + delay >= self.budget:
+                self.stats['exhausted'] += 1
+                if error is not None:
+                    raise PixelaUnavailableException(UNAVAILABLE_MESSAGE) from error
+                return status, response
+            self.stats['retries'] += 1
+            logger.info('Retrying %s request to Pixela after %s, attempt %d.', method,
+                        error or status, attempt + 1)
+            await asyncio.sleep(delay)
+
+
+retry_policy = RetryPolicy()
+
+
+class CircuitBreaker:
+    """
+    Stops sending requests to Pixela while it is down, so that callers fail at once instead of
+    waiting for timeouts. Breaker opens after a number of consecutive failures, and after reset time
+    half opens, letting one request through: its success closes breaker, its failure opens it again.
+    Failures are requests Pixela did not answer and its server errors, but not rejections.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, failures: int = PIXELA_BREAKER_FAILURES, reset: float = PIXELA_BREAKER_RESET):
+        """
+        :param failures: consecutive failures opening breaker, 0 disables it
+        :param reset: seconds breaker stays open
+        """
+        self.failures = failures
+        self.reset = reset
+        self.state = self.CLOSED
+        self.failed = 0
+        self.opened = 0.0
+        self.probing = False
+        self.opens = 0
+        self.rejected = 0
+
+    def before(self) -> bool:
+        """
+        Checks whether request may be sent.
+        :return: whether request is the one checking whether Pixela is back
+        :raises PixelaUnavailableException: if breaker is open or request checking Pixela is already sent
+        """
+        if self.state == self.OPEN and time.monotonic() - self.opened >= self.reset:
+            self.state = self.HALF_OPEN
+        if self.state == self.HALF_OPEN and not self.probing:
+            self.probing = True
+            return True
+        if self.state != self.CLOSED:
+            self.rejected += 1
+            retry_in = max(self.reset - (time.monotonic() - self.opened), 1)
+            raise PixelaUnavailableException(f'{UNAVAILABLE_MESSAGE}, повторите через {retry_in:.0f} с')
+        return False
+
+    def record(self, failed: Optional[bool], probe: bool = False):
+        """
+        Records result of request let through.
+        :param failed: whether Pixela failed, None if result tells nothing about Pixela
+        :param probe: whether request was checking whether Pixela is back
+        """
+        if probe:
+            self.probing = False
+        if failed is None:
+            return
+        if not failed:
+            self.state = self.CLOSED
+            self.failed = 0
+            return
+        self.failed += 1
+        if probe or (self.state == self.CLOSED and self.failed >= self.failures):
+            if self.state != self.OPEN:
+                logger.warning('Pixela is considered down after %d failures.', self.failed)
+            self.state = self.OPEN
+            self.opened = time.monotonic()
+            self.opens += 1
+
+    async def run(self, send: Callable[[], Awaitable[Tuple[int, Optional[dict]]]]) -> Tuple[int, Optional[dict]]:
+        """
+        Sends request unless breaker is open, recording whether Pixela answered it.
+        :param send: function sending request and returning status and decoded response
+        :return: status and decoded response
+        """
+        if not self.failures:
+            return await send()
+        probe = self.before()
+        failed = None
+        try:
+            status, response = await send()
+            failed = status >= 500 and not (response and response.get('isRejected'))
+            return status, response
+        except PixelaUnavailableException:
+            failed = True
+            raise
+        finally:
+            self.record(failed, probe)
+
+    def stats(self) -> dict:
+        retry_in = max(self.reset - (time.monotonic() - self.opened), 0) if self.state == self.OPEN else 0
+        return {'state': self.state, 'failures': self.failed, 'opens': self.opens,
+                'rejected': self.rejected, 'retry_in': round(retry_in, 1)}
+
+
+circuit_breaker = CircuitBreaker()
+
+
+class TokenBucket:
+    """
+    Token bucket handing out reservations, so waiting requests are served in order of arrival.
+    """
+
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, now: float, max_wait: Optional[float] = None) -> Optional[float]:
+        """
+        Takes a token, possibly one which is not refilled yet.
+        :param now: monotonic time
+        :param max_wait: longest acceptable wait in seconds, token is not taken if it is exceeded
+        :return: seconds to wait until taken token is available or None if token is not taken
+        """
+        self.refill(now)
+        delay = (1 - self.tokens) / self.rate if self.tokens < 1 else 0.0
+        if max_wait is not None and delay > max_wait:
+            return None
+        self.tokens -= 1
+        return delay
+
+    def is_full(self, now: float) -> bool:
+        return self.tokens + (now - self.updated) * self.rate >= self.capacity
+
+
+class RateLimiter:
+    """
+    Limits rate of requests to Pixela per Pixela user and globally, delaying requests over the limits.
+    """
+
+    def __init__(self, rate: float = PIXELA_RATE_LIMIT, burst: int = PIXELA_RATE_BURST,
+                 user_rate: float = PIXELA_USER_RATE_LIMIT, user_burst: int = PIXELA_USER_RATE_BURST,
+                 max_keys: int = PIXELA_RATE_LIMIT_KEYS):
+        """
+        :param rate: requests per second of all users
+        :param burst: number of requests of all users allowed at once
+        :param user_rate: requests per second of one user
+        :param user_burst: number of requests of one user allowed at once
+        :param max_keys: number of user buckets after which idle ones are dropped
+        """
+        self.bucket = TokenBucket(rate, burst) if rate > 0 else None
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.max_keys = max_keys
+        self.buckets = {}
+        self.waits = QueryStats()
+        self.rejected = 0
+
+    def user_bucket(self, key: str, now: float) -> TokenBucket:
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            if len(self.buckets) >= self.max_keys:
+                self.buckets = {name: item for name, item in self.buckets.items() if not item.is_full(now)}
+            bucket = self.buckets[key] = TokenBucket(self.user_rate, self.user_burst)
+        return bucket
+
+    async def acquire(self, key: Optional[str] = None, max_wait: Optional[float] = None) -> float:
+        """
+        Waits until request is allowed by limit of given user and then by global limit.
+        :param key: pixela username, requests without one are limited only globally
+        :param max_wait: longest acceptable wait in seconds
+        :return: seconds waited
+        :raises PixelaDataException: if request would have to wait longer than max_wait
+        """
+        start = time.monotonic()
+        buckets = []
+        if key and self.user_rate > 0:
+            buckets.append(self.user_bucket(key, start))
+        if self.bucket is not None:
+            buckets.append(self.bucket)
+        for bucket in buckets:
+            now = time.monotonic()
+            delay = bucket.reserve(now, None if max_wait is None else max_wait - (now - start))
+            if delay is None:
+                self.rejected += 1
+                raise PixelaDataException('Too many requests to Pixela, try again later.')
+            if delay:
+                await asyncio.sleep(delay)
+        waited = time.monotonic() - start
+        self.waits.add(waited * 1000)
+        return waited
+
+    def stats(self) -> dict:
+        return {'users': len(self.buckets), 'rejected': self.rejected, 'wait': self.waits.snapshot()}
+
+
+rate_limiter = RateLimiter()
+
+
+class GraphCache:
+    """
+    Graph definitions of Pixela users, filled by listing graphs of a user and dropped when they are changed.
+    Graphs are keyed by username together with token, so they are served only to callers
+    who could have fetched them from Pixela.
+    """
+
+    def __init__(self, ttl: float = PIXELA_GRAPHS_TTL, max_size: int = PIXELA_GRAPHS_CACHE_SIZE):
+        """
+        :param ttl: seconds graphs of a user are kept
+        :param max_size: number of users kept, least recently used are dropped
+        """
+        self.ttl = ttl
+        self.max_size = max_size
+        self._users: 'OrderedDict[Tuple[str, str], Tuple[Dict[str, dict], float]]' = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _get(self, key: Tuple[str, str]) -> Optional[Dict[str, dict]]:
+        item = self._users.get(key)
+        if item is None:
+            return None
+        graphs, expires = item
+        if expires <= time.monotonic():
+            del self._users[key]
+            return None
+        self._users.move_to_end(key)
+        return graphs
+
+    def get_graphs(self, key: Tuple[str, str]) -> Optional[List[dict]]:
+        """
+        Gets cached graphs of user.
+        :param key: username and token
+        :return: copies of graphs or None if they are not cached
+        """
+        graphs = self._get(key)
+        if graphs is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return [dict(graph) for graph in graphs.values()]
+
+    def get_graph(self, key: Tuple[str, str], graph_id: str) -> Optional[dict]:
+        """
+        Gets cached graph of user.
+        :return: copy of graph or None if it is not cached
+        """
+        graphs = self._get(key)
+        graph = graphs.get(graph_id) if graphs is not None else None
+        if graph is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return dict(graph)
+
+    def set_graphs(self, key: Tuple[str, str], graphs: List[dict]):
+        self._users[key] = ({graph['id']: dict(graph) for graph in graphs}, time.monotonic() + self.ttl)
+        self._users.move_to_end(key)
+        while len(self._users) > self.max_size:
+            self._users.popitem(last=False)
+
+    def invalidate(self, key: Tuple[str, str]):
+        self._users.pop(key, None)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {'users': len(self._users), 'hits': self.hits, 'misses': self.misses,
+                'hit_rate': round(self.hits / total, 3) if total else 0.0}
+
+
+graph_cache = GraphCache()
+
+
+class PixelCache:
+    """
+    Pixels of graphs, loaded once with whole history or by date windows and then updated in place
+    by writes of this process. Pixels changed elsewhere (on Pixela site or by other bot instance)
+    show up when ttl since loading expires. Graphs are keyed by username, token and graph id.
+    """
+
+    def __init__(self, ttl: float = PIXELA_PIXELS_TTL, max_size: int = PIXELA_PIXELS_CACHE_SIZE):
+        """
+        :param ttl: seconds pixels of a graph are kept since they were loaded
+        :param max_size: number of graphs and of windows kept, least recently used are dropped
+        """
+        self.ttl = ttl
+        self.max_size = max_size
+        self._graphs: 'OrderedDict[Tuple[str, str, str], Tuple[Dict[str, str], float]]' = OrderedDict()
+        self._windows: 'OrderedDict[Tuple[Tuple[str, str, str], str, str], Tuple[Dict[str, str], float]]' = \
+            OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _get_item(items: OrderedDict, key) -> Optional[Dict[str, str]]:
+        item = items.get(key)
+        if item is None:
+            return None
+        pixels, expires = item
+        if expires <= time.monotonic():
+            del items[key]
+            return None
+        return pixels
+
+    def _set_item(self, items: OrderedDict, key, pixels: List[Pixels]):
+        items[key] = ({pixel['date']: pixel['quantity'] for pixel in pixels}, time.monotonic() + self.ttl)
+        items.move_to_end(key)
+        while len(items) > self.max_size:
+            items.popitem(last=False)
+
+    @staticmethod
+    def _to_list(pixels: Dict[str, str], from_: str = None, to: str = None) -> List[Pixels]:
+        return [{'date': date_, 'quantity': quantity} for date_, quantity in sorted(pixels.items())
+                if (from_ is None or date_ >= from_) and (to is None or date_ <= to)]
+
+    def _found(self, items: OrderedDict, key, pixels: Optional[Dict[str, str]]) -> bool:
+        if pixels is None:
+            self.misses += 1
+            return False
+        self.hits += 1
+        items.move_to_end(key)
+        return True
+
+    def get(self, key: Tuple[str, str, str]) -> Optional[List[Pixels]]:
+        """
+        Gets cached pixels of graph.
+        :param key: username, token and graph id
+        :return: pixels sorted by date or None if they are not cached
+        """
+        pixels = self._get_item(self._graphs, key)
+        if not self._found(self._graphs, key, pixels):
+            return None
+        return self._to_list(pixels)
+
+    def get_window(self, key: Tuple[str, str, str], from_: str, to: str) -> Optional[List[Pixels]]:
+        """
+        Gets cached pixels of graph between given dates, taken from whole history if it is cached.
+        :param key: username, token and graph id
+        :param from_: first date in yyyyMMdd format
+        :param to: last date in yyyyMMdd format
+        :return: pixels sorted by date or None if they are not cached
+        """
+        pixels = self._get_item(self._graphs, key)
+        if pixels is not None:
+            self._found(self._graphs, key, pixels)
+            return self._to_list(pixels, from_, to)
+        window = (key, from_, to)
+        pixels = self._get_item(self._windows, window)
+        if not self._found(self._windows, window, pixels):
+            return None
+        return self._to_list(pixels)
+
+    def set(self, key: Tuple[str, str, str], pixels: List[Pixels]):
+        self._set_item(self._graphs, key, pixels)
+
+    def set_window(self, key: Tuple[str, str, str], from_: str, to: str, pixels: List[Pixels]):
+        self._set_item(self._windows, (key, from_, to), pixels)
+
+    def _containing(self, key: Tuple[str, str, str], date_: str) -> List[Dict[str, str]]:
+        """
+        Gets cached pixels of graph, whole and windows, which include given date.
+        """
+        found = []
+        pixels = self._get_item(self._graphs, key)
+        if pixels is not None:
+            found.append(pixels)
+        for window in [window for window in self._windows
+                       if window[0] == key and window[1] <= date_ <= window[2]]:
+            pixels = self._get_item(self._windows, window)
+            if pixels is not None:
+                found.append(pixels)
+        return found
+
+    def set_pixel(self, key: Tuple[str, str, str], date_: str, quantity: str):
+        """
+        Puts written pixel into graph, if pixels of graph are cached.
+        """
+        for pixels in self._containing(key, date_):
+            pixels[date_] = quantity
+
+    def delete_pixel(self, key: Tuple[str, str, str], date_: str):
+        for pixels in self._containing(key, date_):
+            pixels.pop(date_, None)
+
+    def invalidate(self, key: Tuple[str, str, str]):
+        self._graphs.pop(key, None)
+        for window in [window for window in self._windows if window[0] == key]:
+            del self._windows[window]
+
+    def invalidate_user(self, user_key: Tuple[str, str]):
+        """
+        Drops pixels of all graphs of user.
+        :param user_key: username and token
+        """
+        for key in {key for key in self._graphs if key[:2] == user_key} | \
+                {window[0] for window in self._windows if window[0][:2] == user_key}:
+            self.invalidate(key)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {'graphs': len(self._graphs), 'windows': len(self._windows), 'hits': self.hits,
+                'misses': self.misses, 'hit_rate': round(self.hits / total, 3) if total else 0.0}
+
+
+pixel_cache = PixelCache()
+
+
+class Singleflight:
+    """
+    Coalesces concurrent identical reads, so callers asking for the same thing while
+    a request for it is in flight get its result instead of sending their own request.
+    """
+
+    def __init__(self):
+        self._flights: Dict[Tuple, asyncio.Future] = {}
+        self.calls = 0
+        self.shared = 0
+
+    async def do(self, key: Tuple, call: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Runs call unless call with the same key is already running, then waits for that one.
+        Call is not cancelled when the caller who started it is, as others may wait for it.
+        :param key: identity of request
+        :param call: function starting request
+        :return: result of call
+        """
+        future = self._flights.get(key)
+        if future is not None:
+            self.shared += 1
+        else:
+            self.calls += 1
+            future = self._flights[key] = asyncio.ensure_future(call())
+            future.add_done_callback(partial(self._done, key))
+        return await asyncio.shield(future)
+
+    def _done(self, key: Tuple, future: asyncio.Future):
+        if self._flights.get(key) is future:
+            del self._flights[key]
+        if not future.cancelled():
+            # Marks exception as retrieved when every waiting caller was cancelled
+            future.exception()
+
+    def stats(self) -> dict:
+        total = self.calls + self.shared
+        return {'in_flight': len(self._flights), 'calls': self.calls, 'shared': self.shared,
+                'shared_rate': round(self.shared / total, 3) if total else 0.0}
+
+
+singleflight = Singleflight()
+
+
+def get_session() -> aiohttp.ClientSession:
+    """
+    Gets application-wide session for Pixela requests, creating it on first use.
+    All requests share its connection pool, so connections to pixe.la are kept alive and reused.
+    :return: session
+    """
+    global _session
+    if _session is None or _session.closed:
+        connector = aiohttp.TCPConnector(limit=PIXELA_CONNECTION_LIMIT,
+                                         keepalive_timeout=PIXELA_KEEPALIVE_TIMEOUT,
+                                         ttl_dns_cache=PIXELA_DNS_CACHE_TTL)
+        _session = aiohttp.ClientSession(connector=connector,
+                                         timeout=aiohttp.ClientTimeout(total=PIXELA_REQUEST_TIMEOUT))
+    return _session
+
+
+async def close_session():
+    """
+    Closes application-wide session.
+    """
+    global _session
+    if _session is not None:
+        await _session.close()
+        _session = None
+
+
 def generate_name(name: str) -> str:
     """
     Generates pixela username.
@@ -55,6 +670,350 @@ def generate_name(name: str) -> str:
     return NAME_PREFIX + name.lower()
 
 
+class PixelaClient:
+    """
+    Client of Pixela API bound to session and credentials of one Pixela user.
+    """
+
+    USERS_URL = PIXELA_BASE_URL + 'users'
+    USER_URL = USERS_URL + '/{username}'
+    GRAPHS_URL = USER_URL + '/graphs'
+
+    def __init__(self, session: aiohttp.ClientSession, token: str = None, username: str = None,
+                 dumps: Callable[[Any], str] = json_dumps, loads: Callable[[str], Any] = json_loads,
+                 retry: RetryPolicy = retry_policy, limiter: RateLimiter = rate_limiter,
+                 graphs: GraphCache = graph_cache, pixels: PixelCache = pixel_cache,
+                 flights: Singleflight = singleflight, breaker: CircuitBreaker = circuit_breaker):
+        """
+        :param session: aiohttp session
+        :param token: user token
+        :param username: pixela username
+        :param dumps: json encoder of payloads
+        :param loads: json decoder of responses
+        :param retry: policy of repeating rejected and failed requests
+        :param limiter: rate limiter of requests
+        :param graphs: cache of graph definitions
+        :param pixels: cache of pixels of graphs
+        :param flights: coalescing of concurrent identical reads
+        :param breaker: circuit breaker failing requests at once while Pixela is down
+        """
+        self.session = session
+        self.retry = retry
+        self.limiter = limiter
+        self.graphs = graphs
+        self.pixels = pixels
+        self.flights = flights
+        self.breaker = breaker
+        self.cache_key = (username, token)
+        self.token = token
+        self.username = username
+        self.dumps = dumps
+        self.loads = loads
+        self.headers = {'X-USER-TOKEN': token} if token else None
+        self.user_url = self.USER_URL.format(username=username) if username else None
+        self.graphs_url = self.GRAPHS_URL.format(username=username) if username else None
+
+    def graph_url(self, graph_id: str) -> str:
+        return self.graphs_url + '/' + graph_id
+
+    def pixel_url(self, graph_id: str, date_: str) -> str:
+        return self.graphs_url + '/' + graph_id + '/' + date_
+
+    def pixels_key(self, graph_id: str) -> Tuple[str, str, str]:
+        return self.cache_key + (graph_id,)
+
+    @staticmethod
+    def endpoint(method: str, url: str) -> str:
+        """
+        Gets endpoint of Pixela API the request belongs to, one of keys of PIXELA_ENDPOINT_TIMEOUTS.
+        """
+        path = url[len(PIXELA_BASE_URL):].split('?')[0].split('/')
+        if len(path) <= 2:
+            return 'users'
+        if len(path) == 4 and path[3].endswith('.html'):
+            return 'page'
+        if len(path) == 4 and method == 'POST':
+            # Pixel is posted to url of its graph
+            return 'pixel'
+        if len(path) <= 4 or path[4] == 'graph-def':
+            return 'graphs'
+        return 'pixels' if path[4] == 'pixels' else 'pixel'
+
+    async def send(self, method: str, url: str, payload: Union[dict, list] = None, auth: bool = True,
+                   decode: bool = True) -> Tuple[int, Optional[dict]]:
+        """
+        Sends request to Pixela within rate limits, repeating it according to retry policy.
+        :param method: http method
+        :param url: full url
+        :param payload: request body to be encoded as json
+        :param auth: whether to send user token
+        :param decode: whether to decode json response
+        :return: status and decoded response
+        """
+        data = self.dumps(payload) if payload is not None else None
+        headers = self.headers if auth else None
+
+        async def attempt(timeout: float) -> Tuple[int, Optional[dict]]:
+            # Waiting for rate limiter is a part of attempt's share of retry budget
+            waited = await self.limiter.acquire(self.username, max_wait=timeout)
+            timeout = max(timeout - waited, 0.1)
+            async with self.session.request(method, url, headers=headers, data=data,
+                                            timeout=aiohttp.ClientTimeout(total=timeout)) as resp:
+                if not decode:
+                    return resp.status, None
+                try:
+                    return resp.status, await resp.json(loads=self.loads, content_type=None)
+                except ValueError:
+                    return resp.status, {'message': f'Unexpected response of Pixela with status {resp.status}.'}
+
+        timeout = PIXELA_ENDPOINT_TIMEOUTS.get(self.endpoint(method, url), PIXELA_REQUEST_TIMEOUT)
+        call = partial(self.breaker.run, partial(self.retry.run, method, attempt, timeout))
+        if method in COALESCED_METHODS:
+            return await self.flights.do((method, url, headers and self.token, decode), call)
+        return await call()
+
+    async def request(self, method: str, url: str, payload: Union[dict, list] = None, auth: bool = True) -> dict:
+        """
+        Sends request to Pixela and decodes its json response.
+        :param method: http method
+        :param url: full url
+        :param payload: request body to be encoded as json
+        :param auth: whether to send user token
+        :return: decoded response
+        """
+        return (await self.send(method, url, payload, auth))[1]
+
+    async def request_success(self, method: str, url: str, payload: Union[dict, list] = None, auth: bool = True):
+        """
+        Sends request which Pixela answers with isSuccess flag.
+        :raises PixelaDataException: with message of Pixela if request failed
+        """
+        response = await self.request(method, url, payload, auth)
+        if not response.get('isSuccess'):
+            raise PixelaDataException(response.get('message'))
+
+    @staticmethod
+    def validate_graph(type: str, color: str):
+        if color not in COLOR_NAMES:
+            raise PixelaDataException('Choose correct color.')
+        if type not in GRAPH_TYPES:
+            raise PixelaDataException('Choose correct data type.')
+
+    @staticmethod
+    def validate_quantity(quantity: Union[int, float]):
+        if type(quantity) not in (int, float):
+            raise PixelaDataException('Wrong data type of quantity.')
+
+    @staticmethod
+    def parse_graph(item: dict) -> dict:
+        return {'id': item['id'], 'name': item['name'], 'unit': item['unit'],
+                'type': item['type'], 'color': Color[item['color']].name}
+
+    async def create_user(self, name: str) -> Tuple[str, str]:
+        username = generate_name(name)
+        payload = {
+            'token': self.token,
+            'username': username,
+            'agreeTermsOfService': 'yes',
+            'notMinor': 'yes'
+        }
+        await self.request_success('POST', self.USERS_URL, payload, auth=False)
+        return self.token, username
+
+    async def delete_user(self) -> bool:
+        try:
+            await self.request_success('DELETE', self.user_url)
+        finally:
+            self.graphs.invalidate(self.cache_key)
+            self.pixels.invalidate_user(self.cache_key)
+        return True
+
+    async def create_graph(self, name: str, unit: str, type: Literal['int', 'float'], color: str) -> str:
+        self.validate_graph(type, color)
+        id = re.sub(r'[\W_]', '-', name.lower())
+        payload = {
+            'id': id,
+            'name': name,
+            'unit': unit,
+            'type': type,
+            'color': color
+        }
+        try:
+            await self.request_success('POST', self.graphs_url, payload)
+        finally:
+            self.graphs.invalidate(self.cache_key)
+        return id
+
+    async def get_graph(self, graph_id: str) -> dict:
+        graph = self.graphs.get_graph(self.cache_key, graph_id)
+        if graph is not None:
+            return graph
+        response = await self.request('GET', self.graph_url(graph_id) + '/graph-def')
+        if response.get('id'):
+            return self.parse_graph(response)
+        raise PixelaDataException(response.get('message'))
+
+    async def get_graphs(self, refresh: bool = False) -> List[dict]:
+        """
+        Gets graphs of user from cache unless refresh is requested.
+        :param refresh: whether to load graphs from Pixela even if they are cached
+        :return: graphs
+        """
+        graphs = None if refresh else self.graphs.get_graphs(self.cache_key)
+        if graphs is not None:
+            return graphs
+        response = await self.request('GET', self.graphs_url)
+        graphs = response.get('graphs')
+        if graphs is None:
+            raise PixelaDataException(response.get('message'))
+        graphs = [self.parse_graph(item) for item in graphs]
+        self.graphs.set_graphs(self.cache_key, graphs)
+        return graphs
+
+    async def show_graph(self, graph_id: str, known: bool = False) -> str:
+        """
+        Gets url of graph page, checking that graph exists unless it is known or cached.
+        Page itself is not downloaded, its existence is checked with HEAD request.
+        :param graph_id:
+        :param known: whether caller already knows that graph exists
+        :return: url
+        """
+        url = self.graph_url(graph_id) + '.html?mode=simple'
+        if known or (self.token and self.graphs.get_graph(self.cache_key, graph_id) is not None):
+            return url
+        status, _ = await self.send('HEAD', url, auth=False, decode=False)
+        if status == 405:
+            # HEAD is not routed to the page, so it has to be rendered after all
+            status, _ = await self.send('GET', url, auth=False, decode=False)
+        if status < 400:
+            return url
+        raise PixelaDataException(status)
+
+    async def update_graph(self, id: str, name: str, unit: str, type: Literal['int', 'float'],
+                           color: str) -> str:
+        self.validate_graph(type, color)
+        payload = {
+            'name': name,
+            'unit': unit,
+            'type': type,
+            'color': color
+        }
+        try:
+            await self.request_success('PUT', self.graph_url(id), payload)
+        finally:
+            self.graphs.invalidate(self.cache_key)
+        return id
+
+    async def delete_graph(self, graph_id: str) -> bool:
+        try:
+            await self.request_success('DELETE', self.graph_url(graph_id))
+        finally:
+            self.graphs.invalidate(self.cache_key)
+            self.pixels.invalidate(self.pixels_key(graph_id))
+        return True
+
+    async def get_pixels(self, graph_id: str, refresh: bool = False, from_: str = None,
+                         to: str = None) -> List[Pixels]:
+        """
+        Gets pixels of graph, all or between given dates, from cache unless refresh is requested.
+        :param graph_id:
+        :param refresh: whether to load pixels from Pixela even if they are cached
+        :param from_: first date in yyyyMMdd format, window requires both dates
+        :param to: last date in yyyyMMdd format
+        :return: pixels
+        """
+        return (await self.fetch_pixels(graph_id, refresh, from_, to))[0]
+
+    async def fetch_pixels(self, graph_id: str, refresh: bool = False, from_: str = None,
+                           to: str = None) -> Tuple[List[Pixels], bool]:
+        """
+        Gets pixels like get_pixels, telling also whether they were loaded from Pixela.
+        :return: pixels and false if they were taken from cache
+        """
+        key = self.pixels_key(graph_id)
+        window = from_ is not None and to is not None
+        if not refresh:
+            pixels = self.pixels.get_window(key, from_, to) if window else self.pixels.get(key)
+            if pixels is not None:
+                return pixels, False
+        url = self.graph_url(graph_id) + '/pixels?withBody=true'
+        if window:
+            url += f'&from={from_}&to={to}'
+        response = await self.request('GET', url)
+        pixels = response.get('pixels')
+        if pixels is None:
+            raise PixelaDataException(response.get('message'))
+        pixels = [{'date': pixel['date'], 'quantity': pixel['quantity']} for pixel in pixels]
+        if window:
+            self.pixels.set_window(key, from_, to, pixels)
+        else:
+            self.pixels.set(key, pixels)
+        return pixels, True
+
+    async def write_pixel(self, method: str, url: str, graph_id: str, date_: str, payload: dict = None):
+        """
+        Sends change of pixel and applies it to cached pixels of graph.
+        If it fails, cached pixels are dropped, since it is unknown whether pixel was changed.
+        """
+        key = self.pixels_key(graph_id)
+        try:
+            await self.request_success(method, url, payload)
+        except BaseException:
+            self.pixels.invalidate(key)
+            raise
+        if payload is None:
+            self.pixels.delete_pixel(key, date_)
+        else:
+            self.pixels.set_pixel(key, date_, payload['quantity'])
+
+    async def post_pixel(self, graph_id: str, date_: str, quantity: Union[int, float]) -> str:
+        self.validate_quantity(quantity)
+        try:
+            datetime.strptime(date_, "%Y%m%d")
+        except ValueError as exc:
+            raise PixelaDataException('Wrong data format of date.') from exc
+        except TypeError as exc:
+            raise PixelaDataException('Wrong data type of date.') from exc
+        payload = {
+            'date': date_,
+            'quantity': str(quantity)
+        }
+        await self.write_pixel('POST', self.graph_url(graph_id), graph_id, date_, payload)
+        return date_
+
+    async def post_pixels(self, graph_id: str, pixels: List[Pixels]) -> int:
+        """
+        Posts several pixels with single request to batch endpoint of Pixela.
+        :param graph_id:
+        :param pixels: pixels with dates in yyyyMMdd format and quantities as strings
+        :return: number of posted pixels
+        """
+        key = self.pixels_key(graph_id)
+        payload = [{'date': pixel['date'], 'quantity': str(pixel['quantity'])} for pixel in pixels]
+        try:
+            await self.request_success('POST', self.graph_url(graph_id) + '/pixels', payload)
+        except BaseException:
+            self.pixels.invalidate(key)
+            raise
+        for pixel in payload:
+            self.pixels.set_pixel(key, pixel['date'], pixel['quantity'])
+        return len(payload)
+
+    async def update_pixel(self, graph_id: str, date_: str, quantity: Union[int, float] = 0) -> str:
+        self.validate_quantity(quantity)
+        try:
+            datetime.strptime(date_, "%Y%m%d")
+        except ValueError as exc:
+            raise PixelaDataException('Wrong data format of date.') from exc
+        await self.write_pixel('PUT', self.pixel_url(graph_id, date_), graph_id, date_,
+                               {'quantity': str(quantity)})
+        return date_
+
+    async def delete_pixel(self, graph_id: str, date_: str) -> bool:
+        await self.write_pixel('DELETE', self.pixel_url(graph_id, date_), graph_id, date_)
+        return True
+
+
 async def create_user(session: aiohttp.ClientSession, token: str, name: str) -> Tuple[str, str]:
     """
     Creates user of pixela
@@ -63,21 +1022,7 @@ async def create_user(session: aiohttp.ClientSession, token: str, name: str) ->
     :param name: username
     :return: token and name if successful or None
     """
-    url = PIXELA_BASE_URL + 'users'
-    username = generate_name(name)
-    payload = {
-        "token": token,
-        'username': username,
-        'agreeTermsOfService': 'yes',
-        'notMinor': 'yes'
-    }
-    async with session.post(url, data=json.dumps(payload)) as resp:
-        response = await resp.json()
-        # response = requests.post(url, data=json.dumps(payload)).json()
-        if response.get('isSuccess'):
-            return token, username
-        else:
-            raise PixelaDataException(response.get('message'))
+    return await PixelaClient(session, token).create_user(name)
 
 
 async def delete_user(session: aiohttp.ClientSession, token: str, username: str) -> bool:
@@ -88,15 +1033,7 @@ async def delete_user(session: aiohttp.ClientSession, token: str, username: str)
     :param username: username
     :return: token and name if successful or None
     """
-    url = PIXELA_BASE_URL + 'users/' + username
-    headers = {'X-USER-TOKEN': token}
-    async with session.delete(url, headers=headers) as resp:
-        response = await resp.json()
-    # response = requests.delete(url, headers=headers).json()
-        if response.get('isSuccess'):
-            return True
-        else:
-            raise PixelaDataException(response.get('message'))
+    return await PixelaClient(session, token, username).delete_user()
 
 
 async def create_graph(session: aiohttp.ClientSession,
@@ -117,27 +1054,7 @@ async def create_graph(session: aiohttp.ClientSession,
     :param color: str with predefined color
     :return: graph id
     """
-    if color not in [e.name for e in Color]:
-        raise PixelaDataException('Choose correct color.')
-    if type not in ('int', 'float'):
-        raise PixelaDataException('Choose correct data type.')
-    url = PIXELA_BASE_URL + 'users/' + username + '/graphs'
-    id = re.sub(r'[\W_]', '-', name.lower())
-    headers = {'X-USER-TOKEN': token}
-    payload = {
-        'id': id,
-        'name': name,
-        'unit': unit,
-        'type': type,
-        'color': color
-    }
-    async with session.post(url, headers=headers, data=json.dumps(payload)) as resp:
-        response = await resp.json()
-    # response = requests.post(url, headers=headers, data=json.dumps(payload)).json()
-        if response.get('isSuccess'):
-            return id
-        else:
-            raise PixelaDataException(response.get('message'))
+    return await PixelaClient(session, token, username).create_graph(name, unit, type, color)
 
 
 async def get_graph(session: aiohttp.ClientSession, token: str, username: str, graph_id: str) -> dict:
@@ -149,18 +1066,7 @@ async def get_graph(session: aiohttp.ClientSession, token: str, username: str, g
     :param graph_id:
     :return:
     """
-    url = (PIXELA_BASE_URL + 'users/' + username + '/graphs/'
-           + graph_id + '/graph-def')
-    headers = {'X-USER-TOKEN': token}
-    async with session.get(url, headers=headers) as resp:
-        response = await resp.json()
-    # response = requests.get(url, headers=headers).json()
-        if response.get('id'):
-            graph = {'id': response['id'], 'name': response['name'], 'unit': response['unit'],
-                     'type': response['type'], 'color': Color[response['color']].name}
-            return graph
-        else:
-            raise PixelaDataException(response.get('message'))
+    return await PixelaClient(session, token, username).get_graph(graph_id)
 
 
 async def get_graphs(session: aiohttp.ClientSession, token: str, username: str) -> List[dict]:
@@ -171,36 +1077,21 @@ async def get_graphs(session: aiohttp.ClientSession, token: str, username: str)
     :param username:
     :return: list of graphs names and units
     """
-    url = PIXELA_BASE_URL + 'users/' + username + '/graphs'
-    headers = {'X-USER-TOKEN': token}
-    async with session.get(url, headers=headers) as resp:
-        response = await resp.json()
-    # response = requests.get(url, headers=headers).json()
-        if response.get('graphs') is not None:
-            graphs = []
-            for item in response.get('graphs'):
-                graphs.append({'id': item['id'], 'name': item['name'], 'unit': item['unit'],
-                               'type': item['type'], 'color': Color[item['color']].name})
-            return graphs
-        else:
-            raise PixelaDataException(response.get('message'))
+    return await PixelaClient(session, token, username).get_graphs()
 
 
-async def show_graph(session: aiohttp.ClientSession, username: str, graph_id: str) -> Optional[str]:
+async def show_graph(session: aiohttp.ClientSession, username: str, graph_id: str,
+                     token: str = None, known: bool = False) -> Optional[str]:
     """
     Gets url for certain graph.
     :param session:
     :param username:
     :param graph_id:
+    :param token: user token, lets cached graphs of user be used instead of checking the page
+    :param known: whether graph is known to exist, then it is not checked
     :return: url
     """
-    url = PIXELA_BASE_URL + 'users/' + username + '/graphs/' + graph_id + '.html?mode=simple'
-    async with session.get(url) as response:
-    # response = requests.get(url)
-        if response.ok:
-            return url
-        else:
-            raise PixelaDataException(response.status)
+    return await PixelaClient(session, token, username).show_graph(graph_id, known)
 
 
 async def update_graph(session: aiohttp.ClientSession,
@@ -223,25 +1114,7 @@ async def update_graph(session: aiohttp.ClientSession,
     :param color: color of given colors
     :return: graph id
     """
-    if color not in [e.name for e in Color]:
-        raise PixelaDataException('Choose correct color.')
-    if type not in ('int', 'float'):
-        raise PixelaDataException('Choose correct data type.')
-    url = PIXELA_BASE_URL + 'users/' + username + '/graphs/' + id
-    headers = {'X-USER-TOKEN': token}
-    payload = {
-        'name': name,
-        'unit': unit,
-        'type': type,
-        'color': color
-    }
-    async with session.put(url, headers=headers, data=json.dumps(payload)) as resp:
-        response = await resp.json()
-    # response = requests.put(url, headers=headers, data=json.dumps(payload)).json()
-        if response.get('isSuccess'):
-            return id
-        else:
-            raise PixelaDataException(response.get('message'))
+    return await PixelaClient(session, token, username).update_graph(id, name, unit, type, color)
 
 
 async def delete_graph(session: aiohttp.ClientSession,
@@ -256,41 +1129,46 @@ async def delete_graph(session: aiohttp.ClientSession,
     :param graph_id:
     :return: graph id
     """
-    url = PIXELA_BASE_URL + 'users/' + username + '/graphs/' + graph_id
-    headers = {'X-USER-TOKEN': token}
-    async with session.delete(url, headers=headers) as resp:
-        response = await resp.json()
-    # response = requests.delete(url, headers=headers).json()
-        if response.get('isSuccess'):
-            return True
-        else:
-            raise PixelaDataException(response.get('message'))
+    return await PixelaClient(session, token, username).delete_graph(graph_id)
 
 
 async def get_pixels(session: aiohttp.ClientSession,
                      token: str,
                      username: str,
-                     graph_id: str) -> List[Pixels]:
+                     graph_id: str,
+                     refresh: bool = False,
+                     from_: str = None,
+                     to: str = None) -> List[Pixels]:
     """
     Get list of pixels for certain graph.
     :param session:
     :param token: user token
     :param username:
     :param graph_id:
+    :param refresh: whether to load pixels from Pixela even if they are cached
+    :param from_: first date of window in yyyyMMdd format
+    :param to: last date of window in yyyyMMdd format
     :return: list of pixels
     """
-    url = PIXELA_BASE_URL + 'users/' + username + '/graphs/' + graph_id + '/pixels?withBody=true'
-    headers = {'X-USER-TOKEN': token}
-    async with session.get(url, headers=headers) as resp:
-        response = await resp.json()
-    # response = requests.get(url, headers=headers).json()
-        pixels = response.get('pixels')
-        if pixels:
-            return [{'date': pixel['date'], 'quantity': pixel['quantity']} for pixel in pixels]
-        elif pixels == []:
-            return []
-        else:
-            raise PixelaDataException(response.get('message'))
+    return await PixelaClient(session, token, username).get_pixels(graph_id, refresh, from_, to)
+
+
+async def fetch_pixels(session: aiohttp.ClientSession,
+                       token: str,
+                       username: str,
+                       graph_id: str,
+                       refresh: bool = False) -> Tuple[List[Pixels], bool]:
+    """
+    Get list of all pixels for certain graph and whether they were loaded from Pixela,
+    so copies of pixels elsewhere are updated only when they could have changed.
+    :param session:
+    :param token: user token
+    :param username:
+    :param graph_id:
+    :param refresh: whether to load pixels from Pixela even if they are cached
+    :return: list of pixels and false if they were taken from cache
+    """
+    return await PixelaClient(session, token, username).fetch_pixels(graph_id, refresh)
 
 
 async def post_pixel(session: aiohttp.ClientSession,
@@ -309,27 +1187,24 @@ async def post_pixel(session: aiohttp.ClientSession,
     :param date_:
     :return: graph id
     """
-    if type(quantity) not in (int, float):
-        raise PixelaDataException('Wrong data type of quantity.')
-    try:
-        datetime.strptime(date_, "%Y%m%d")
-    except ValueError as exc:
-        raise PixelaDataException('Wrong data format of date.') from exc
-    except TypeError as exc:
-        raise PixelaDataException('Wrong data type of date.') from exc
-    url = PIXELA_BASE_URL + 'users/' + username + '/graphs/' + graph_id
-    headers = {'X-USER-TOKEN': token}
-    payload = {
-        'date': date_,
-        'quantity': str(quantity)
-    }
-    async with session.post(url, headers=headers, data=json.dumps(payload)) as resp:
-        response = await resp.json()
-    # response = requests.post(url, headers=headers, data=json.dumps(payload)).json()
-        if response.get('isSuccess'):
-            return date_
-        else:
-            raise PixelaDataException(response.get('message'))
+    return await PixelaClient(session, token, username).post_pixel(graph_id, date_, quantity)
+
+
+async def post_pixels(session: aiohttp.ClientSession,
+                      token: str,
+                      username: str,
+                      graph_id: str,
+                      pixels: List[Pixels]) -> int:
+    """
+    Posts several pixels at once inside given graph
+    :param session:
+    :param token: user token
+    :param username:
+    :param graph_id:
+    :param pixels: pixels with dates in yyyyMMdd format
+    :return: number of posted pixels
+    """
+    return await PixelaClient(session, token, username).post_pixels(graph_id, pixels)
 
 
 async def update_pixel(session: aiohttp.ClientSession,
@@ -348,24 +1223,7 @@ async def update_pixel(session: aiohttp.ClientSession,
     :param quantity:
     :return: graph id
     """
-    if type(quantity) not in (int, float):
-        raise PixelaDataException('Wrong data type of quantity.')
-    try:
-        datetime.strptime(date_, "%Y%m%d")
-    except ValueError as exc:
-        raise PixelaDataException('Wrong data format of date.') from exc
-    url = PIXELA_BASE_URL + 'users/' + username + '/graphs/' + graph_id + '/' + date_
-    headers = {'X-USER-TOKEN': token}
-    payload = {
-        'quantity': str(quantity)
-    }
-    async with session.put(url, headers=headers, data=json.dumps(payload)) as resp:
-        response = await resp.json()
-    # response = requests.put(url, headers=headers, data=json.dumps(payload)).json()
-        if response.get('isSuccess'):
-            return date_
-        else:
-            raise PixelaDataException(response.get('message'))
+    return await PixelaClient(session, token, username).update_pixel(graph_id, date_, quantity)
 
 
 async def delete_pixel(session: aiohttp.ClientSession,
@@ -382,13 +1240,4 @@ async def delete_pixel(session: aiohttp.ClientSession,
     :param date_:
     :return: graph id
     """
-    url = PIXELA_BASE_URL + 'users/' + username + '/graphs/' + graph_id + '/' + date_
-    headers = {'X-USER-TOKEN': token}
-    async with session.delete(url, headers=headers) as resp:
-        response = await resp.json()
-    # response = requests.delete(url, headers=headers).json()
-        if response.get('isSuccess'):
-            return True
-        else:
-            raise PixelaDataException(response.get('message'))
-
+    return await PixelaClient(session, token, username).delete_pixel(graph_id, date_)
@@ -0,0 +1,657 @@
+"""
+Module with storage backends keeping users and cached pixels.
+Backend is chosen with STORAGE_BACKEND environment variable: postgres (default), sqlite or memory.
+"""
+
+import asyncio
+import bisect
+import functools
+import logging
+import os
+from datetime import date, timedelta
+from pathlib import Path
+from typing import List, Optional, Dict, Tuple, Callable, AsyncIterator, Mapping, Sequence
+
+from metrics import query_metrics
+from json_codec import json_dumps, json_loads
+
+try:
+    import asyncpg
+except ImportError:
+    asyncpg = None
+
+try:
+    import aiosqlite
+except ImportError:
+    aiosqlite = None
+
+
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', default='postgres').lower()
+SQLITE_PATH = os.getenv('SQLITE_PATH', default='habit_bot.sqlite3')
+
+DB_POOL_MIN_SIZE = int(os.getenv('DB_POOL_MIN_SIZE', default=2))
+DB_POOL_MAX_SIZE = int(os.getenv('DB_POOL_MAX_SIZE', default=10))
+# Seconds to wait for a free connection from the pool
+DB_ACQUIRE_TIMEOUT = float(os.getenv('DB_ACQUIRE_TIMEOUT', default=10))
+DB_COMMAND_TIMEOUT = float(os.getenv('DB_COMMAND_TIMEOUT', default=30))
+# Connections are recycled after this number of queries or seconds of inactivity
+DB_MAX_QUERIES = int(os.getenv('DB_MAX_QUERIES', default=50000))
+DB_MAX_INACTIVE_LIFETIME = float(os.getenv('DB_MAX_INACTIVE_LIFETIME', default=300))
+DB_RECONNECT_ATTEMPTS = int(os.getenv('DB_RECONNECT_ATTEMPTS', default=5))
+DB_RECONNECT_DELAY = float(os.getenv('DB_RECONNECT_DELAY', default=0.5))
+# Apply sql files from migrations directory on connect
+RUN_MIGRATIONS = os.getenv('RUN_MIGRATIONS', 'true').lower() not in ('0', 'false', 'no')
+MIGRATIONS_DIR = Path(__file__).resolve().parent / 'migrations'
+# Any constant shared by all bot instances, so that only one of them migrates at a time
+MIGRATIONS_LOCK_ID = 7240513
+
+# Columns of users table
+USER_FIELDS = ('telegram_id', 'username', 'pixela_token', 'pixela_name', 'user_state', 'graph', 'pixel',
+               'editting')
+JSON_FIELDS = ('graph', 'pixel')
+
+logger = logging.getLogger(__name__)
+
+
+def month_bounds(dates: Sequence[date], month: date, direction: str) -> Tuple[Optional[date], Optional[date]]:
+    """
+    Finds the closest month with pixels before (prev) or starting from (next) given month.
+    :param dates: sorted dates of pixels
+    :param month: first day of current month
+    :param direction: prev or next
+    :return: first day of found month and first day of the month after it, or Nones
+    """
+    i = bisect.bisect_left(dates, month)
+    if direction == 'prev':
+        if i == 0:
+            return None, None
+        start = dates[i - 1].replace(day=1)
+    else:
+        if i == len(dates):
+            return None, None
+        start = dates[i].replace(day=1)
+    return start, (start + timedelta(days=31)).replace(day=1)
+
+
+def select_month(pixels: Sequence[Tuple[date, str]], month: date, direction: str) -> List[Tuple[date, str]]:
+    """
+    Selects pixels of the closest month with pixels before (prev) or starting from (next) given month,
+    plus the nearest pixel outside of that month if there is one.
+    :param pixels: pixels sorted by date
+    :param month: first day of current month
+    :param direction: prev or next
+    :return: list of dates and quantities
+    """
+    dates = [pixel[0] for pixel in pixels]
+    start, stop = month_bounds(dates, month, direction)
+    if start is None:
+        return []
+    if direction == 'prev':
+        first = bisect.bisect_left(dates, start)
+        return list(pixels[max(first - 1, 0):bisect.bisect_left(dates, month)])
+    last = bisect.bisect_left(dates, stop)
+    return list(pixels[bisect.bisect_left(dates, month):last + 1])
+
+
+class Storage:
+    """
+    Base class of storage backends. Users are passed as mappings with USER_FIELDS keys,
+    saved users as rows of telegram_id, username and values of given columns.
+    """
+
+    async def connect(self):
+        """
+        Prepares storage for work.
+        """
+
+    async def close(self):
+        """
+        Releases storage resources.
+        """
+
+    async def fetch_user(self, id: int) -> Optional[Mapping]:
+        """
+        Gets single user.
+        :param id: telegram id
+        :return: user data or None
+        """
+        raise NotImplementedError
+
+    def iterate_users(self, chunk_size: int) -> AsyncIterator[Mapping]:
+        """
+        Iterates over all users, fetching them by chunks.
+        :param chunk_size: number of users fetched at once
+        """
+        raise NotImplementedError
+
+    async def save_users(self, columns: Tuple[str, ...], rows: List[tuple]):
+        """
+        Inserts users or updates given columns of existing ones.
+        :param columns: names of saved columns
+        :param rows: tuples of telegram id, username and values of columns
+        """
+        raise NotImplementedError
+
+    async def replace_pixels(self, user_id: int, graph_id: str, pixels: List[Tuple[date, str]]):
+        """
+        Replaces cached pixels of given graph.
+        :param user_id: telegram id
+        :param graph_id:
+        :param pixels: dates and quantities
+        """
+        raise NotImplementedError
+
+    async def save_pixel(self, user_id: int, graph_id: str, date_: date, quantity: str):
+        """
+        Adds or updates single cached pixel.
+        """
+        raise NotImplementedError
+
+    async def delete_pixel(self, user_id: int, graph_id: str, date_: date):
+        """
+        Removes single cached pixel.
+        """
+        raise NotImplementedError
+
+    async def delete_graph_pixels(self, user_id: int, graph_id: str):
+        """
+        Removes cached pixels of deleted graph.
+        """
+        raise NotImplementedError
+
+    async def delete_user_pixels(self, user_id: int):
+        """
+        Removes cached pixels of all graphs of deleted user.
+        """
+        raise NotImplementedError
+
+    async def fetch_month(self, user_id: int, graph_id: str, month: date,
+                          direction: str) -> List[Tuple[date, str]]:
+        """
+        Gets cached pixels of the closest month with pixels before (prev) or starting from (next)
+        given month, plus the nearest pixel outside of that month if there is one.
+        :param user_id: telegram id
+        :param graph_id:
+        :param month: first day of current month
+        :param direction: prev or next
+        :return: dates and quantities
+        """
+        raise NotImplementedError
+
+    async def notify(self, channel: str, payload: str):
+        """
+        Sends notification to other bot instances. Only shared storages support it.
+        """
+
+    async def listen(self, channel: str, callback: Callable[[str], None],
+                     on_reconnect: Optional[Callable[[], None]] = None):
+        """
+        Subscribes to notifications from other bot instances. Only shared storages support it.
+        """
+
+
+class MemoryStorage(Storage):
+    """
+    Storage keeping everything in process memory, for tests and load testing without database.
+    """
+
+    def __init__(self):
+        self.users: Dict[int, dict] = {}
+        self.pixels: Dict[Tuple[int, str], Dict[date, str]] = {}
+
+    async def fetch_user(self, id: int) -> Optional[Mapping]:
+        user = self.users.get(id)
+        return dict(user) if user else None
+
+    async def iterate_users(self, chunk_size: int) -> AsyncIterator[Mapping]:
+        for i, user in enumerate(list(self.users.values()), start=1):
+            yield dict(user)
+            if i % chunk_size == 0:
+                await asyncio.sleep(0)
+
+    async def save_users(self, columns: Tuple[str, ...], rows: List[tuple]):
+        for row in rows:
+            user = self.users.setdefault(row[0], dict.fromkeys(USER_FIELDS))
+            user.update(zip(('telegram_id', 'username') + columns, row))
+
+    async def replace_pixels(self, user_id: int, graph_id: str, pixels: List[Tuple[date, str]]):
+        self.pixels[user_id, graph_id] = dict(pixels)
+
+    async def save_pixel(self, user_id: int, graph_id: str, date_: date, quantity: str):
+        self.pixels.setdefault((user_id, graph_id), {})[date_] = quantity
+
+    async def delete_pixel(self, user_id: int, graph_id: str, date_: date):
+        self.pixels.get((user_id, graph_id), {}).pop(date_, None)
+
+    async def delete_graph_pixels(self, user_id: int, graph_id: str):
+        self.pixels.pop((user_id, graph_id), None)
+
+    async def delete_user_pixels(self, user_id: int):
+        for key in [key for key in self.pixels if key[0] == user_id]:
+            del self.pixels[key]
+
+    async def fetch_month(self, user_id: int, graph_id: str, month: date,
+                          direction: str) -> List[Tuple[date, str]]:
+        pixels = sorted(self.pixels.get((user_id, graph_id), {}).items())
+        return select_month(pixels, month, direction)
+
+
+class SQLiteStorage(Storage):
+    """
+    Storage in local SQLite file, requires aiosqlite.
+    """
+
+    def __init__(self, path: str = SQLITE_PATH):
+        if aiosqlite is None:
+            raise RuntimeError('aiosqlite is required for sqlite storage.')
+        self.path = path
+        self.conn: Optional['aiosqlite.Connection'] = None
+
+    async def connect(self):
+        self.conn = await aiosqlite.connect(self.path)
+        self.conn.row_factory = aiosqlite.Row
+        await self.conn.executescript('''
+        CREATE TABLE IF NOT EXISTS users (
+            telegram_id integer PRIMARY KEY,
+            username text,
+            pixela_token text,
+            pixela_name text,
+            user_state text,
+            graph text,
+            pixel text,
+            editting integer
+        );
+        CREATE TABLE IF NOT EXISTS pixels_cache (
+            telegram_id integer NOT NULL,
+            graph_id text NOT NULL,
+            date text NOT NULL,
+            quantity text NOT NULL,
+            PRIMARY KEY (telegram_id, graph_id, date)
+        );
+        ''')
+        await self.conn.commit()
+
+    async def close(self):
+        await self.conn.close()
+
+    @staticmethod
+    def _user_from_row(row: 'aiosqlite.Row') -> dict:
+        user = dict(row)
+        for field in JSON_FIELDS:
+            if user[field] is not None:
+                user[field] = json_loads(user[field])
+        if user['editting'] is not None:
+            user['editting'] = bool(user['editting'])
+        return user
+
+    async def fetch_user(self, id: int) -> Optional[Mapping]:
+        async with self.conn.execute(f'SELECT {", ".join(USER_FIELDS)} FROM users WHERE telegram_id = ?',
+                                     (id,)) as cursor:
+            row = await cursor.fetchone()
+        return self._user_from_row(row) if row else None
+
+    async def iterate_users(self, chunk_size: int) -> AsyncIterator[Mapping]:
+        async with self.conn.execute(f'SELECT {", ".join(USER_FIELDS)} FROM users') as cursor:
+            while True:
+                rows = await cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield self._user_from_row(row)
+
+    @staticmethod
+    @functools.lru_cache(maxsize=128)
+    def _save_users_query(columns: Tuple[str, ...]) -> str:
+        columns = ('telegram_id', 'username') + columns
+        assignments = ', '.join(f'{column} = excluded.{column}' for column in columns[1:])
+        return (f'INSERT INTO users ({", ".join(columns)}) VALUES ({", ".join("?" * len(columns))}) '
+                f'ON CONFLICT (telegram_id) DO UPDATE SET {assignments}')
+
+    async def save_users(self, columns: Tuple[str, ...], rows: List[tuple]):
+        json_indexes = [i for i, column in enumerate(columns, start=2) if column in JSON_FIELDS]
+        encoded = []
+        for row in rows:
+            row = list(row)
+            for i in json_indexes:
+                if row[i] is not None:
+                    row[i] = json_dumps(row[i])
+            encoded.append(row)
+        await self.conn.executemany(self._save_users_query(columns), encoded)
+        await self.conn.commit()
+
+    async def replace_pixels(self, user_id: int, graph_id: str, pixels: List[Tuple[date, str]]):
+        await self.conn.execute('DELETE FROM pixels_cache WHERE telegram_id = ? AND graph_id = ?',
+                                (user_id, graph_id))
+        await self.conn.executemany(
+            'INSERT INTO pixels_cache (telegram_id, graph_id, date, quantity) VALUES (?, ?, ?, ?)',
+            [(user_id, graph_id, date_.isoformat(), quantity) for date_, quantity in pixels])
+        await self.conn.commit()
+
+    async def save_pixel(self, user_id: int, graph_id: str, date_: date, quantity: str):
+        await self.conn.execute('''
+        INSERT INTO pixels_cache (telegram_id, graph_id, date, quantity) VALUES (?, ?, ?, ?)
+        ON CONFLICT (telegram_id, graph_id, date) DO UPDATE SET quantity = excluded.quantity
+        ''', (user_id, graph_id, date_.isoformat(), quantity))
+        await self.conn.commit()
+
+    async def delete_pixel(self, user_id: int, graph_id: str, date_: date):
+        await self.conn.execute('DELETE FROM pixels_cache WHERE telegram_id = ? AND graph_id = ? AND date = ?',
+                                (user_id, graph_id, date_.isoformat()))
+        await self.conn.commit()
+
+    async def delete_graph_pixels(self, user_id: int, graph_id: str):
+        await self.conn.execute('DELETE FROM pixels_cache WHERE telegram_id = ? AND graph_id = ?',
+                                (user_id, graph_id))
+        await self.conn.commit()
+
+    async def delete_user_pixels(self, user_id: int):
+        await self.conn.execute('DELETE FROM pixels_cache WHERE telegram_id = ?', (user_id,))
+        await self.conn.commit()
+
+    async def fetch_month(self, user_id: int, graph_id: str, month: date,
+                          direction: str) -> List[Tuple[date, str]]:
+        async with self.conn.execute(
+                'SELECT date, quantity FROM pixels_cache WHERE telegram_id = ? AND graph_id = ? ORDER BY date',
+                (user_id, graph_id)) as cursor:
+            pixels = [(date.fromisoformat(row['date']), row['quantity']) for row in await cursor.fetchall()]
+        return select_month(pixels, month, direction)
+
+
+class PostgresStorage(Storage):
+    """
+    Storage in PostgreSQL database, working through pool of connections.
+    """
+
+    def __init__(self, url: str, name: str = '', user: str = '', pwd: str = '',
+                 min_size: int = DB_POOL_MIN_SIZE, max_size: int = DB_POOL_MAX_SIZE,
+                 acquire_timeout: float = DB_ACQUIRE_TIMEOUT):
+        if asyncpg is None:
+            raise RuntimeError('asyncpg is required for postgres storage.')
+        self.url = url
+        self.name = name
+        self.user = user
+        self.pwd = pwd
+        self.min_size = min_size
+        self.max_size = max_size
+        self.acquire_timeout = acquire_timeout
+        self.pool: 'asyncpg.pool.Pool' = None
+        # Dedicated connection for LISTEN, pooled ones are returned to pool after each query
+        self.listener: Optional['asyncpg.connection.Connection'] = None
+        self.listeners: Dict[str, Callable[[str], None]] = {}
+        self.on_listener_reconnect: Optional[Callable[[], None]] = None
+        self.closing = False
+        # Errors meaning the server went away (e.g. Postgres restart), worth reconnecting on
+        self.reconnect_errors = (
+            asyncpg.exceptions.PostgresConnectionError,
+            asyncpg.exceptions.CannotConnectNowError,
+            asyncpg.exceptions.AdminShutdownError,
+            ConnectionError,
+            OSError,
+        )
+
+    @property
+    def connect_kwargs(self) -> dict:
+        if self.name:
+            return dict(user=self.user, password=self.pwd, database=self.name, host=self.url)
+        return dict(dsn=self.url)
+
+    async def connect(self):
+        """
+        Creating pool of connections, retrying while database is not available yet.
+        """
+        self.closing = False
+        for attempt in range(1, DB_RECONNECT_ATTEMPTS + 1):
+            try:
+                self.pool = await asyncpg.create_pool(
+                    min_size=self.min_size,
+                    max_size=self.max_size,
+                    max_queries=DB_MAX_QUERIES,
+                    max_inactive_connection_lifetime=DB_MAX_INACTIVE_LIFETIME,
+                    command_timeout=DB_COMMAND_TIMEOUT,
+                    init=self.init_connection,
+                    **self.connect_kwargs)
+                break
+            except self.reconnect_errors as exc:
+                if attempt == DB_RECONNECT_ATTEMPTS:
+                    raise
+                logger.warning('Database is unavailable (%s), retrying connection.', exc)
+                await asyncio.sleep(DB_RECONNECT_DELAY * attempt)
+        if RUN_MIGRATIONS:
+            await self.migrate()
+
+    @staticmethod
+    async def init_connection(conn: 'asyncpg.connection.Connection'):
+        """
+        Registers codecs, so json values are encoded and decoded only once on python side.
+        """
+        for type_ in ('json', 'jsonb'):
+            await conn.set_type_codec(type_, encoder=json_dumps, decoder=json_loads,
+                                      schema='pg_catalog')
+
+    async def migrate(self):
+        """
+        Applies sql files from migrations directory which were not applied yet, each in transaction.
+        """
+        async with self.pool.acquire(timeout=self.acquire_timeout) as conn:
+            async with conn.transaction():
+                await conn.execute('SELECT pg_advisory_xact_lock($1)', MIGRATIONS_LOCK_ID)
+                await conn.execute('''
+                CREATE TABLE IF NOT EXISTS schema_migrations (
+                    version text PRIMARY KEY,
+                    applied_at timestamptz NOT NULL DEFAULT now()
+                );
+                ''')
+                applied = {item['version'] for item in await conn.fetch('SELECT version FROM schema_migrations')}
+                for path in sorted(MIGRATIONS_DIR.glob('*.sql')):
+                    if path.stem in applied:
+                        continue
+                    logger.info('Applying migration %s.', path.name)
+                    await conn.execute(path.read_text())
+                    await conn.execute('INSERT INTO schema_migrations (version) VALUES ($1)', path.stem)
+
+    async def listen(self, channel: str, callback: Callable[[str], None],
+                     on_reconnect: Optional[Callable[[], None]] = None):
+        """
+        Subscribes to notifications on given channel. If listening connection is lost,
+        it is restored and on_reconnect is called, since notifications could be missed meanwhile.
+        :param channel: channel name
+        :param callback: function called with payload of each notification
+        :param on_reconnect: function called after listening connection is restored
+        """
+        self.listeners[channel] = callback
+        if on_reconnect:
+            self.on_listener_reconnect = on_reconnect
+        if self.listener is None or self.listener.is_closed():
+            self.listener = await asyncpg.connect(**self.connect_kwargs)
+            self.listener.add_termination_listener(self._listener_terminated)
+        await self.listener.add_listener(channel, self._notification_received)
+
+    def _notification_received(self, conn: 'asyncpg.connection.Connection', pid: int, channel: str, payload: str):
+        callback = self.listeners.get(channel)
+        if callback:
+            callback(payload)
+
+    def _listener_terminated(self, conn: 'asyncpg.connection.Connection'):
+        if not self.closing:
+            logger.warning('Listening connection to database is lost, reconnecting.')
+            asyncio.ensure_future(self._reconnect_listener())
+
+    async def _reconnect_listener(self):
+        attempt = 0
+        while not self.closing:
+            attempt += 1
+            try:
+                self.listener = await asyncpg.connect(**self.connect_kwargs)
+                self.listener.add_termination_listener(self._listener_terminated)
+                for channel in self.listeners:
+                    await self.listener.add_listener(channel, self._notification_received)
+                break
+            except self.reconnect_errors as exc:
+                logger.warning('Failed to restore listening connection (%s).', exc)
+                await asyncio.sleep(DB_RECONNECT_DELAY * min(attempt, DB_RECONNECT_ATTEMPTS))
+        if self.on_listener_reconnect and not self.closing:
+            self.on_listener_reconnect()
+
+    async def notify(self, channel: str, payload: str):
+        """
+        Sends notification to given channel.
+        """
+        await self._run('notify', 'execute', 'SELECT pg_notify($1, $2)', channel, payload)
+
+    async def close(self):
+        """
+        Close listening connection and all connections of the pool.
+        """
+        self.closing = True
+        if self.listener is not None and not self.listener.is_closed():
+            await self.listener.close()
+        await self.pool.close()
+
+    async def _run(self, name: str, method: str, query: str, *args):
+        """
+        Runs query on a connection acquired from the pool. If connection turns out to be broken,
+        stale connections are expired and query is repeated on a fresh one.
+        Time spent including waiting for connection and retries is recorded under statement name.
+        :param name: statement name for metrics
+        :param method: name of connection method, e.g. fetch or execute
+        :param query: sql query
+        :param args: query arguments
+        :return: result of the query
+        """
+        with query_metrics.timer(name):
+            for attempt in range(1, DB_RECONNECT_ATTEMPTS + 1):
+                try:
+                    async with self.pool.acquire(timeout=self.acquire_timeout) as conn:
+                        return await getattr(conn, method)(query, *args)
+                except asyncio.TimeoutError:
+                    # Subclass of OSError since python 3.11, but busy pool or slow query is not a lost connection
+                    raise
+                except self.reconnect_errors as exc:
+                    if attempt == DB_RECONNECT_ATTEMPTS:
+                        raise
+                    logger.warning('Lost connection to database (%s), reconnecting.', exc)
+                    await self.pool.expire_connections()
+                    await asyncio.sleep(DB_RECONNECT_DELAY * attempt)
+
+    async def fetch_user(self, id: int) -> Optional[Mapping]:
+        return await self._run('fetch_user', 'fetchrow',
+                               f'SELECT {", ".join(USER_FIELDS)} FROM users WHERE telegram_id = $1', id)
+
+    async def iterate_users(self, chunk_size: int) -> AsyncIterator[Mapping]:
+        """
+        Iterates over users with server-side cursor, fetching them by chunks.
+        """
+        async with self.pool.acquire(timeout=self.acquire_timeout) as conn:
+            async with conn.transaction():
+                async for record in conn.cursor(f'SELECT {", ".join(USER_FIELDS)} FROM users',
+                                                prefetch=chunk_size):
+                    yield record
+
+    @staticmethod
+    @functools.lru_cache(maxsize=128)
+    def _save_users_query(columns: Tuple[str, ...]) -> str:
+        """
+        Builds upsert for given columns. Queries are cached per set of columns,
+        so asyncpg reuses its prepared statement for each of them.
+        """
+        columns = ('telegram_id', 'username') + columns
+        values = ', '.join(f'${i}' for i in range(1, len(columns) + 1))
+        assignments = ', '.join(f'{column} = EXCLUDED.{column}' for column in columns[1:])
+        return f'''
+        INSERT INTO users ({', '.join(columns)}) VALUES ({values})
+        ON CONFLICT (telegram_id) DO UPDATE SET {assignments};
+        '''
+
+    async def save_users(self, columns: Tuple[str, ...], rows: List[tuple]):
+        await self._run('save_users', 'executemany', self._save_users_query(columns), rows)
+
+    async def replace_pixels(self, user_id: int, graph_id: str, pixels: List[Tuple[date, str]]):
+        """
+        Replaces cached pixels with single statement, only new and changed pixels are written.
+        """
+        query = '''
+        WITH deleted AS (
+            DELETE FROM pixels_cache
+            WHERE telegram_id = $1 AND graph_id = $2 AND date <> ALL($3::date[])
+        )
+        INSERT INTO pixels_cache (telegram_id, graph_id, date, quantity)
+        SELECT $1, $2, new.date, new.quantity FROM unnest($3::date[], $4::text[]) AS new(date, quantity)
+        ON CONFLICT (telegram_id, graph_id, date) DO UPDATE SET quantity = EXCLUDED.quantity
+        WHERE pixels_cache.quantity IS DISTINCT FROM EXCLUDED.quantity;
+        '''
+        await self._run('replace_pixels', 'execute', query, user_id, graph_id,
+                        [pixel[0] for pixel in pixels], [pixel[1] for pixel in pixels])
+
+    async def save_pixel(self, user_id: int, graph_id: str, date_: date, quantity: str):
+        query = '''
+        INSERT INTO pixels_cache (telegram_id, graph_id, date, quantity) VALUES ($1, $2, $3, $4)
+        ON CONFLICT (telegram_id, graph_id, date) DO UPDATE SET quantity = EXCLUDED.quantity;
+        '''
+        await self._run('save_pixel', 'execute', query, user_id, graph_id, date_, quantity)
+
+    async def delete_pixel(self, user_id: int, graph_id: str, date_: date):
+        query = '''
+        DELETE FROM pixels_cache WHERE telegram_id = $1 AND graph_id = $2 AND date = $3;
+        '''
+        await self._run('delete_pixel', 'execute', query, user_id, graph_id, date_)
+
+    async def delete_graph_pixels(self, user_id: int, graph_id: str):
+        query = '''
+        DELETE FROM pixels_cache WHERE telegram_id = $1 AND graph_id = $2;
+        '''
+        await self._run('delete_graph_pixels', 'execute', query, user_id, graph_id)
+
+    async def delete_user_pixels(self, user_id: int):
+        query = '''
+        DELETE FROM pixels_cache WHERE telegram_id = $1;
+        '''
+        await self._run('delete_user_pixels', 'execute', query, user_id)
+
+    async def fetch_month(self, user_id: int, graph_id: str, month: date,
+                          direction: str) -> List[Tuple[date, str]]:
+        if direction == 'prev':
+            query = '''
+            WITH bounds AS (
+                SELECT date_trunc('month', max(date))::date AS start FROM pixels_cache
+                WHERE telegram_id = $1 AND graph_id = $2 AND date < $3
+            )
+            (SELECT date, quantity FROM pixels_cache, bounds
+             WHERE telegram_id = $1 AND graph_id = $2 AND date >= bounds.start AND date < $3)
+            UNION ALL
+            (SELECT date, quantity FROM pixels_cache, bounds
+             WHERE telegram_id = $1 AND graph_id = $2 AND date < bounds.start
+             ORDER BY date DESC LIMIT 1);
+            '''
+        else:
+            query = '''
+            WITH bounds AS (
+                SELECT (date_trunc('month', min(date)) + interval '1 month')::date AS stop FROM pixels_cache
+                WHERE telegram_id = $1 AND graph_id = $2 AND date >= $3
+            )
+            (SELECT date, quantity FROM pixels_cache, bounds
+             WHERE telegram_id = $1 AND graph_id = $2 AND date >= $3 AND date < bounds.stop)
+            UNION ALL
+            (SELECT date, quantity FROM pixels_cache, bounds
+             WHERE telegram_id = $1 AND graph_id = $2 AND date >= bounds.stop
+             ORDER BY date LIMIT 1);
+            '''
+        items = await self._run('fetch_month', 'fetch', query, user_id, graph_id, month)
+        return [(item['date'], item['quantity']) for item in items]
+
+
+def create_storage(backend: str = STORAGE_BACKEND) -> Storage:
+    """
+    Creates storage of chosen backend. Database settings are read only for postgres.
+    :param backend: postgres, sqlite or memory
+    :return: storage
+    """
+    if backend == 'memory':
+        return MemoryStorage()
+    if backend == 'sqlite':
+        return SQLiteStorage()
+    if backend != 'postgres':
+        raise ValueError(f'Unknown storage backend {backend}.')
+    if os.getenv('HEROKU', False):
+        return PostgresStorage(os.environ['DATABASE_URL'])
+    from config import DATABASE_USER, DATABASE_PASSWORD, DATABASE_NAME, DATABASE_URL
+    return PostgresStorage(url=DATABASE_URL, name=DATABASE_NAME, pwd=DATABASE_PASSWORD, user=DATABASE_USER)
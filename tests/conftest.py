@@ -0,0 +1,42 @@
+"""
+Common settings for tests: users and pixels are kept in memory instead of database,
+requests to Pixela are not rate limited and failures of Pixela do not open circuit breaker.
+Fake aiohttp session answers requests to Pixela with prepared responses.
+"""
+
+import json
+import os
+
+os.environ.setdefault('STORAGE_BACKEND', 'memory')
+os.environ.setdefault('PIXELA_RATE_LIMIT', '0')
+os.environ.setdefault('PIXELA_USER_RATE_LIMIT', '0')
+os.environ.setdefault('PIXELA_BREAKER_FAILURES', '0')
+
+
+class FakeResponse:
+    def __init__(self, status: int = 200, body: str = '{"isSuccess": true}'):
+        self.status = status
+        self.ok = status < 400
+        self.body = body
+
+    async def json(self, loads=json.loads, content_type='application/json'):
+        return loads(self.body)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        pass
+
+
+class FakeSession:
+    def __init__(self, *responses: FakeResponse):
+        self.responses = list(responses)
+        self.calls = []
+
+    def request(self, method: str, url: str, headers: dict = None, data: str = None, timeout=None):
+        self.calls.append((method, url, headers, data))
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
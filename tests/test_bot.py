@@ -295,7 +295,7 @@ CALLBACK_DATAS = [
     None,
 ]
 user_mock = Mock()
-user_mock.graph = {'unit': 'min'}
+user_mock.graph = Graph(unit='min')
 
 
 def create_custom_markup(date_: date, dir_: str, quant: str) -> types.InlineKeyboardMarkup:
@@ -376,8 +376,6 @@ async def test_main_handler():
     initial_mess_mock = AsyncMock(text=INPUTS[0], from_user=user)
 
     patchers = []
-    patchers.append(patch('habit_bot.create_db_user', AsyncMock()))
-    patchers.append(patch('habit_bot.save_user', AsyncMock()))
     patchers.append(patch('habit_bot.bot.pin_chat_message', AsyncMock()))
 
     patchers.append(patch('habit_bot.create_user', AsyncMock(return_value=API_RETURNS[0])))
@@ -388,6 +386,7 @@ async def test_main_handler():
     patchers.append(patch('habit_bot.update_graph', AsyncMock(return_value=API_RETURNS[5])))
     patchers.append(patch('habit_bot.delete_graph', AsyncMock(return_value=API_RETURNS[6])))
     patchers.append(patch('habit_bot.get_pixels', AsyncMock(return_value=API_RETURNS[7])))
+    patchers.append(patch('habit_bot.fetch_pixels', AsyncMock(return_value=(API_RETURNS[7], True))))
     patchers.append(patch('habit_bot.post_pixel', AsyncMock(return_value=API_RETURNS[8])))
     patchers.append(patch('habit_bot.update_pixel', AsyncMock(return_value=API_RETURNS[9])))
     patchers.append(patch('habit_bot.delete_pixel', AsyncMock(return_value=API_RETURNS[10])))
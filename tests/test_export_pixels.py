@@ -0,0 +1,49 @@
+"""
+Tests export of graphs and pixels into csv file.
+"""
+
+import csv
+import io
+import pytest
+from export_pixels import ExportLimiter, write_export
+from pixela import PixelaClient, GraphCache, PixelCache, Singleflight
+from conftest import FakeResponse, FakeSession
+
+GRAPHS = FakeResponse(body='{"graphs": [{"id": "g1", "name": "run", "unit": "km", "type": "float", "color": "sora"},'
+                           '{"id": "g2", "name": "read", "unit": "page", "type": "int", "color": "ajisai"}]}')
+PIXELS = FakeResponse(body='{"pixels": [{"date": "20220101", "quantity": "1"}, {"date": "20220102", "quantity": "2"}]}')
+
+
+@pytest.mark.asyncio
+async def test_write_export():
+    session = FakeSession(GRAPHS, PIXELS, PIXELS)
+    client = PixelaClient(session, 'token', 'md-user', graphs=GraphCache(), pixels=PixelCache(),
+                          flights=Singleflight())
+    file = io.StringIO(newline='')
+    assert await write_export(client, file) == 4
+    rows = list(csv.reader(io.StringIO(file.getvalue())))
+    assert rows[0] == ['graph_id', 'graph_name', 'unit', 'type', 'date', 'quantity']
+    assert sorted(rows[1:]) == [['g1', 'run', 'km', 'float', '20220101', '1'],
+                                ['g1', 'run', 'km', 'float', '20220102', '2'],
+                                ['g2', 'read', 'page', 'int', '20220101', '1'],
+                                ['g2', 'read', 'page', 'int', '20220102', '2']]
+
+
+@pytest.mark.asyncio
+async def test_export_ignores_cached_pixels():
+    session = FakeSession(GRAPHS, PIXELS, PIXELS)
+    client = PixelaClient(session, 'token', 'md-user', graphs=GraphCache(), pixels=PixelCache(),
+                          flights=Singleflight())
+    client.graphs.set_graphs(client.cache_key, [])
+    client.pixels.set(client.pixels_key('g1'), [])
+    assert await write_export(client, io.StringIO(newline='')) == 4
+    assert len(session.calls) == 3
+
+
+def test_export_limiter():
+    limiter = ExportLimiter(per_user=1)
+    assert limiter.acquire(1)
+    assert not limiter.acquire(1)
+    assert limiter.acquire(2)
+    limiter.release(1)
+    assert limiter.acquire(1)
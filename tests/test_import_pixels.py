@@ -0,0 +1,57 @@
+"""
+Tests parsing of csv files with pixels and their upload in batches.
+"""
+
+import json
+import pytest
+from import_pixels import parse_pixels_csv, upload_pixels
+from pixela import PixelaClient, PixelaDataException, PixelCache
+from conftest import FakeResponse, FakeSession
+
+
+class TestParsePixelsCsv:
+    def test_valid_file(self):
+        text = 'date,quantity\n2022-01-02,2\n20220101,1\n\n03.01.2022,3\n20220101,4\n'
+        assert parse_pixels_csv(text, 'int') == ([{'date': '20220101', 'quantity': '4'},
+                                                  {'date': '20220102', 'quantity': '2'},
+                                                  {'date': '20220103', 'quantity': '3'}], [])
+
+    def test_semicolon_and_decimal_comma(self):
+        assert parse_pixels_csv('20220101;1,5\n20220102;2\n', 'float') == (
+            [{'date': '20220101', 'quantity': '1.5'}, {'date': '20220102', 'quantity': '2.0'}], [])
+
+    def test_errors(self):
+        pixels, errors = parse_pixels_csv('20220101,1\n20221301,2\n20220103,1.5\n20220104\n', 'int')
+        assert pixels == [{'date': '20220101', 'quantity': '1'}]
+        assert errors == ['Строка 2: неверная дата 20221301.',
+                          'Строка 3: количество 1.5 не типа int.',
+                          'Строка 4: нужны дата и количество.']
+
+    def test_quantities_must_be_finite(self):
+        pixels, errors = parse_pixels_csv('20220101,nan\n20220102,inf\n20220103,1e400\n20220104,1e3\n', 'float')
+        assert pixels == [{'date': '20220104', 'quantity': '1000.0'}]
+        assert len(errors) == 3
+
+
+@pytest.mark.asyncio
+class TestUploadPixels:
+    async def test_batches_and_progress(self):
+        session = FakeSession(FakeResponse(), FakeResponse(), FakeResponse())
+        pixels = [{'date': f'202201{day:02}', 'quantity': '1'} for day in range(1, 6)]
+        progress = []
+
+        async def report(uploaded: int):
+            progress.append(uploaded)
+
+        assert await upload_pixels(PixelaClient(session, 'token', 'md-user', pixels=PixelCache()), 'graph',
+                                   pixels, report, batch_size=2, concurrency=2) == (5, None)
+        assert [len(json.loads(call[3])) for call in session.calls] == [2, 2, 1]
+        assert progress == [2, 4, 5]
+
+    async def test_failed_batch(self):
+        session = FakeSession(FakeResponse(), FakeResponse(400, '{"message": "Wrong."}'), FakeResponse())
+        pixels = [{'date': f'202201{day:02}', 'quantity': '1'} for day in range(1, 6)]
+        uploaded, exc = await upload_pixels(PixelaClient(session, 'token', 'md-user', pixels=PixelCache()), 'graph',
+                                            pixels, batch_size=2)
+        assert uploaded == 3
+        assert isinstance(exc, PixelaDataException)
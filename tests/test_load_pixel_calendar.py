@@ -0,0 +1,43 @@
+"""
+Tests choosing pixels for calendar of pixels.
+"""
+
+from datetime import date
+from unittest.mock import AsyncMock, patch
+import pytest
+from load_pixel_calendar import *
+
+
+def test_calendar_window():
+    assert calendar_window(date(2022, 1, 1), 'prev') == (date(2021, 11, 1), date(2021, 12, 31))
+    assert calendar_window(date(2022, 12, 1), 'next') == (date(2022, 12, 1), date(2023, 1, 31))
+
+
+@pytest.mark.asyncio
+class TestGetCalendarPixels:
+    async def test_database_cache_is_used_first(self):
+        user = User(id=1, first_name='user')
+        with patch('load_pixel_calendar.get_cached_month', AsyncMock(return_value=[{'date': '20211215',
+                                                                                   'quantity': '1'}])), \
+                patch('load_pixel_calendar.get_pixels', AsyncMock()) as get_pixels_mock:
+            assert await get_calendar_pixels(user, date(2022, 1, 1), 'prev') == [{'date': '20211215',
+                                                                                  'quantity': '1'}]
+        get_pixels_mock.assert_not_called()
+
+    async def test_window_is_requested_from_pixela(self):
+        user = User(id=1, first_name='user', pixela_token='token', pixela_name='md-user')
+        window = [{'date': '20220105', 'quantity': '1'}, {'date': '20220203', 'quantity': '2'}]
+        with patch('load_pixel_calendar.get_cached_month', AsyncMock(return_value=[])), \
+                patch('load_pixel_calendar.get_pixels', AsyncMock(return_value=window)) as get_pixels_mock:
+            assert await get_calendar_pixels(user, date(2022, 1, 1), 'next') == window
+        assert get_pixels_mock.call_count == 1
+        assert get_pixels_mock.call_args.kwargs == {'from_': '20220101', 'to': '20220228'}
+
+    async def test_history_is_used_when_window_does_not_settle(self):
+        user = User(id=1, first_name='user', pixela_token='token', pixela_name='md-user')
+        history = [{'date': '20210301', 'quantity': '1'}, {'date': '20211110', 'quantity': '2'}]
+        with patch('load_pixel_calendar.get_cached_month', AsyncMock(return_value=[])), \
+                patch('load_pixel_calendar.get_pixels',
+                      AsyncMock(side_effect=[history[1:], history])) as get_pixels_mock:
+            assert await get_calendar_pixels(user, date(2022, 1, 1), 'prev') == history
+        assert get_pixels_mock.call_args.kwargs == {}
@@ -0,0 +1,29 @@
+"""
+Tests collecting timings of database queries.
+"""
+
+from unittest.mock import patch
+import pytest
+from metrics import QueryMetrics
+
+
+class TestQueryMetrics:
+    def test_percentiles_and_histogram(self):
+        metrics = QueryMetrics(slow_query_ms=1000)
+        for ms in range(1, 101):
+            metrics.observe('fetch_user', ms)
+        stats = metrics.snapshot()['fetch_user']
+        assert (stats['count'], stats['p50_ms'], stats['p95_ms'], stats['max_ms']) == (100, 51, 96, 100)
+        assert stats['histogram']['le_1'] == 1
+        assert stats['histogram']['le_100'] == 50
+        assert sum(stats['histogram'].values()) == 100
+
+    def test_slow_and_failed_queries(self):
+        metrics = QueryMetrics(slow_query_ms=200)
+        with patch('metrics.time.perf_counter', side_effect=[0, 0.3]), \
+                patch('metrics.logger.warning') as warning:
+            with pytest.raises(ConnectionError):
+                with metrics.timer('save_users'):
+                    raise ConnectionError
+        warning.assert_called_once_with('Slow query %s took %.1f ms.', 'save_users', 300)
+        assert metrics.snapshot()['save_users']['errors'] == 1
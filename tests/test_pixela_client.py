@@ -0,0 +1,381 @@
+"""
+Tests Pixela client against fake session, without requests to Pixela.
+"""
+
+import json
+from unittest.mock import Mock, patch
+import pytest
+from pixela import *
+from conftest import FakeResponse, FakeSession
+
+
+@pytest.mark.asyncio
+class TestPixelaClient:
+    async def test_post_pixel(self):
+        session = FakeSession(FakeResponse())
+        client = PixelaClient(session, 'token', 'md-user')
+        assert await client.post_pixel('graph', '20220101', 5) == '20220101'
+        method, url, headers, data = session.calls[0]
+        assert (method, url, headers) == ('POST', PIXELA_BASE_URL + 'users/md-user/graphs/graph',
+                                          {'X-USER-TOKEN': 'token'})
+        assert json.loads(data) == {'date': '20220101', 'quantity': '5'}
+
+    async def test_get_graphs(self):
+        session = FakeSession(FakeResponse(body='{"graphs": [{"id": "g", "name": "n", "unit": "min", '
+                                                '"type": "int", "color": "sora"}]}'))
+        client = PixelaClient(session, 'token', 'md-user', graphs=GraphCache())
+        assert await client.get_graphs() == [
+            {'id': 'g', 'name': 'n', 'unit': 'min', 'type': 'int', 'color': 'sora'}]
+
+    async def test_failure_message(self):
+        session = FakeSession(FakeResponse(400, '{"isSuccess": false, "message": "Not found."}'))
+        with pytest.raises(PixelaDataException, match='Not found.'):
+            await delete_pixel(session, 'token', 'md-user', 'graph', '20220101')
+
+    async def test_show_graph_checks_page_with_head(self):
+        session = FakeSession(FakeResponse(), FakeResponse(404))
+        client = PixelaClient(session, username='md-user', graphs=GraphCache())
+        assert await client.show_graph('graph') == PIXELA_BASE_URL + 'users/md-user/graphs/graph.html?mode=simple'
+        with pytest.raises(PixelaDataException):
+            await client.show_graph('missing')
+        assert [call[0] for call in session.calls] == ['HEAD', 'HEAD']
+
+    async def test_show_graph_falls_back_to_get(self):
+        session = FakeSession(FakeResponse(405), FakeResponse())
+        client = PixelaClient(session, username='md-user', graphs=GraphCache())
+        assert await client.show_graph('graph')
+        assert [call[0] for call in session.calls] == ['HEAD', 'GET']
+
+    async def test_show_known_graph(self):
+        session = FakeSession(FakeResponse(body='{"graphs": [{"id": "g", "name": "n", "unit": "min", '
+                                                '"type": "int", "color": "sora"}]}'))
+        client = PixelaClient(session, 'token', 'md-user', graphs=GraphCache())
+        await client.get_graphs()
+        assert await client.show_graph('g')
+        assert await client.show_graph('other', known=True)
+        assert len(session.calls) == 1
+
+    async def test_validation(self):
+        client = PixelaClient(Mock(), 'token', 'md-user')
+        with pytest.raises(PixelaDataException, match='Choose correct color.'):
+            await client.create_graph('name', 'min', 'int', 'pink')
+        with pytest.raises(PixelaDataException, match='Wrong data format of date.'):
+            await client.update_pixel('graph', '2022-01-01', 1)
+
+
+REJECTED = FakeResponse(503, '{"isSuccess": false, "isRejected": true, "message": "Please retry this request."}')
+
+
+@pytest.mark.asyncio
+@patch('pixela.asyncio.sleep')
+class TestRetryPolicy:
+    async def test_rejected_request_is_retried(self, sleep):
+        session = FakeSession(REJECTED, REJECTED, FakeResponse())
+        retry = RetryPolicy(attempts=5)
+        client = PixelaClient(session, 'token', 'md-user', retry=retry, limiter=RateLimiter(rate=0, user_rate=0))
+        assert await client.delete_graph('graph') is True
+        assert len(session.calls) == 3
+        assert sleep.call_count == 2
+        assert retry.stats == {'requests': 1, 'retries': 2, 'recovered': 1, 'exhausted': 0}
+
+    async def test_attempts_are_limited(self, sleep):
+        session = FakeSession(REJECTED, REJECTED)
+        retry = RetryPolicy(attempts=2)
+        with pytest.raises(PixelaDataException, match='Please retry this request.'):
+            await PixelaClient(session, 'token', 'md-user', retry=retry).post_pixel('graph', '20220101', 1)
+        assert retry.stats['exhausted'] == 1
+
+    async def test_timeout_of_post_is_not_retried(self, sleep):
+        session = FakeSession(asyncio.TimeoutError(), FakeResponse())
+        with pytest.raises(PixelaDataException, match=UNAVAILABLE_MESSAGE):
+            await post_pixel(session, 'token', 'md-user', 'graph', '20220101', 1)
+        assert len(session.calls) == 1
+
+    async def test_server_error_of_post_is_not_retried(self, sleep):
+        session = FakeSession(FakeResponse(502, '{"message": "Bad gateway."}'), FakeResponse())
+        with pytest.raises(PixelaDataException, match='Bad gateway.'):
+            await create_graph(session, 'token', 'md-user', 'name', 'min', 'int', 'sora')
+        assert len(session.calls) == 1
+
+    async def test_timeout_of_get_is_retried(self, sleep):
+        session = FakeSession(asyncio.TimeoutError(), FakeResponse(body='{"pixels": []}'))
+        assert await get_pixels(session, 'token', 'md-user', 'graph') == []
+        assert len(session.calls) == 2
+
+
+@pytest.mark.asyncio
+@patch('pixela.asyncio.sleep')
+@patch('pixela.time.monotonic', return_value=100)
+class TestRateLimiter:
+    async def test_user_limit(self, monotonic, sleep):
+        limiter = RateLimiter(rate=0, user_rate=2, user_burst=2)
+        for _ in range(4):
+            await limiter.acquire('md-user')
+        await limiter.acquire('md-other')
+        assert [call.args[0] for call in sleep.call_args_list] == [0.5, 1.0]
+
+    async def test_global_limit(self, monotonic, sleep):
+        limiter = RateLimiter(rate=10, burst=1, user_rate=0)
+        await limiter.acquire('md-user')
+        await limiter.acquire()
+        sleep.assert_called_once_with(0.1)
+        assert limiter.stats()['wait']['count'] == 2
+
+    async def test_wait_over_budget_fails_fast(self, monotonic, sleep):
+        limiter = RateLimiter(rate=0, user_rate=1, user_burst=1)
+        await limiter.acquire('md-user', max_wait=0.5)
+        with pytest.raises(PixelaDataException, match='Too many requests'):
+            await limiter.acquire('md-user', max_wait=0.5)
+        sleep.assert_not_called()
+        assert await limiter.acquire('md-user', max_wait=2) == 0
+        sleep.assert_called_once_with(1.0)
+        assert limiter.stats()['rejected'] == 1
+
+    async def test_idle_buckets_are_dropped(self, monotonic, sleep):
+        limiter = RateLimiter(user_rate=1, user_burst=1, max_keys=2)
+        await limiter.acquire('md-user')
+        monotonic.return_value = 102
+        await limiter.acquire('md-other')
+        await limiter.acquire('md-third')
+        assert set(limiter.buckets) == {'md-other', 'md-third'}
+
+
+GRAPHS = FakeResponse(body='{"graphs": [{"id": "g", "name": "n", "unit": "min", "type": "int", "color": "sora"}]}')
+
+
+@pytest.mark.asyncio
+class TestGraphCache:
+    async def test_graphs_are_cached(self):
+        session = FakeSession(GRAPHS)
+        client = PixelaClient(session, 'token', 'md-user', graphs=GraphCache())
+        graphs = await client.get_graphs()
+        assert await client.get_graphs() == graphs
+        assert await client.get_graph('g') == graphs[0]
+        assert len(session.calls) == 1
+        assert client.graphs.stats() == {'users': 1, 'hits': 2, 'misses': 1, 'hit_rate': 0.667}
+
+    async def test_changes_invalidate_cache(self):
+        session = FakeSession(GRAPHS, FakeResponse(), GRAPHS)
+        client = PixelaClient(session, 'token', 'md-user', graphs=GraphCache())
+        await client.get_graphs()
+        await client.update_graph('g', 'new', 'min', 'int', 'sora')
+        await client.get_graphs()
+        assert len(session.calls) == 3
+
+    async def test_expired_graphs_are_fetched(self):
+        session = FakeSession(GRAPHS, GRAPHS)
+        client = PixelaClient(session, 'token', 'md-user', limiter=RateLimiter(rate=0, user_rate=0),
+                              graphs=GraphCache(ttl=60))
+        with patch('pixela.time.monotonic', return_value=0):
+            await client.get_graphs()
+        with patch('pixela.time.monotonic', return_value=61):
+            await client.get_graphs()
+        assert len(session.calls) == 2
+
+    async def test_graphs_are_not_shared_between_tokens(self):
+        session = FakeSession(GRAPHS, FakeResponse(400, '{"message": "Wrong token."}'))
+        cache = GraphCache()
+        await PixelaClient(session, 'token', 'md-user', graphs=cache).get_graphs()
+        with pytest.raises(PixelaDataException, match='Wrong token.'):
+            await PixelaClient(session, 'wrong', 'md-user', graphs=cache).get_graphs()
+
+
+PIXELS = FakeResponse(body='{"pixels": [{"date": "20220102", "quantity": "2"}, {"date": "20220101", "quantity": "1"}]}')
+
+
+@pytest.mark.asyncio
+class TestPixelCache:
+    async def test_pixels_are_updated_in_place(self):
+        session = FakeSession(PIXELS, FakeResponse(), FakeResponse(), FakeResponse())
+        client = PixelaClient(session, 'token', 'md-user', pixels=PixelCache())
+        await client.get_pixels('graph')
+        await client.post_pixel('graph', '20220103', 3)
+        await client.update_pixel('graph', '20220101', 1.5)
+        await client.delete_pixel('graph', '20220102')
+        assert await client.get_pixels('graph') == [{'date': '20220101', 'quantity': '1.5'},
+                                                    {'date': '20220103', 'quantity': '3'}]
+        assert len(session.calls) == 4
+
+    async def test_fetch_reports_source(self):
+        session = FakeSession(PIXELS, PIXELS)
+        client = PixelaClient(session, 'token', 'md-user', pixels=PixelCache())
+        pixels, fetched = await client.fetch_pixels('graph')
+        assert fetched and len(pixels) == 2
+        assert await client.fetch_pixels('graph') == (sorted(pixels, key=lambda pixel: pixel['date']), False)
+        assert (await client.fetch_pixels('graph', refresh=True))[1]
+
+    async def test_failed_write_drops_pixels(self):
+        session = FakeSession(PIXELS, FakeResponse(400, '{"message": "Wrong."}'), PIXELS)
+        client = PixelaClient(session, 'token', 'md-user', pixels=PixelCache())
+        await client.get_pixels('graph')
+        with pytest.raises(PixelaDataException):
+            await client.delete_pixel('graph', '20220101')
+        assert len(await client.get_pixels('graph')) == 2
+        assert len(session.calls) == 3
+
+    async def test_refresh_and_expiration(self):
+        session = FakeSession(PIXELS, PIXELS, PIXELS)
+        client = PixelaClient(session, 'token', 'md-user', pixels=PixelCache(ttl=60))
+        with patch('pixela.time.monotonic', return_value=0):
+            await client.get_pixels('graph')
+            await client.get_pixels('graph', refresh=True)
+            await client.get_pixels('graph')
+        with patch('pixela.time.monotonic', return_value=61):
+            await client.get_pixels('graph')
+        assert len(session.calls) == 3
+        assert client.pixels.stats()['hits'] == 1
+
+    async def test_batch_post_updates_pixels(self):
+        session = FakeSession(PIXELS, FakeResponse())
+        client = PixelaClient(session, 'token', 'md-user', pixels=PixelCache())
+        await client.get_pixels('graph')
+        assert await client.post_pixels('graph', [{'date': '20220102', 'quantity': 4},
+                                                  {'date': '20220105', 'quantity': '5'}]) == 2
+        method, url, _, data = session.calls[1]
+        assert (method, url) == ('POST', PIXELA_BASE_URL + 'users/md-user/graphs/graph/pixels')
+        assert json.loads(data) == [{'date': '20220102', 'quantity': '4'}, {'date': '20220105', 'quantity': '5'}]
+        assert await client.get_pixels('graph') == [{'date': '20220101', 'quantity': '1'},
+                                                    {'date': '20220102', 'quantity': '4'},
+                                                    {'date': '20220105', 'quantity': '5'}]
+
+    async def test_windows(self):
+        session = FakeSession(FakeResponse(body='{"pixels": [{"date": "20220101", "quantity": "1"}]}'),
+                              FakeResponse(), PIXELS)
+        client = PixelaClient(session, 'token', 'md-user', pixels=PixelCache())
+        window = await client.get_pixels('graph', from_='20211201', to='20220131')
+        assert session.calls[0][1].endswith('/pixels?withBody=true&from=20211201&to=20220131')
+        await client.post_pixel('graph', '20220110', 2)
+        assert await client.get_pixels('graph', from_='20211201', to='20220131') == window + [
+            {'date': '20220110', 'quantity': '2'}]
+        await client.get_pixels('graph')
+        assert await client.get_pixels('graph', from_='20220102', to='20220131') == [
+            {'date': '20220102', 'quantity': '2'}]
+        assert len(session.calls) == 3
+
+
+class SlowSession(FakeSession):
+    """
+    Session whose responses wait for event, so that requests overlap.
+    """
+
+    def __init__(self, *responses: FakeResponse):
+        super().__init__(*responses)
+        self.release = asyncio.Event()
+
+    def request(self, method: str, url: str, headers: dict = None, data: str = None, timeout=None):
+        response = super().request(method, url, headers, data, timeout)
+        release = self.release
+
+        class Slow:
+            async def __aenter__(self):
+                await release.wait()
+                return response
+
+            async def __aexit__(self, *args):
+                pass
+
+        return Slow()
+
+
+@pytest.mark.asyncio
+class TestSingleflight:
+    async def test_concurrent_reads_share_request(self):
+        session = SlowSession(PIXELS, PIXELS)
+        flights = Singleflight()
+        client = PixelaClient(session, 'token', 'md-user', pixels=PixelCache(), flights=flights)
+        other = PixelaClient(session, 'other', 'md-user', pixels=PixelCache(), flights=flights)
+        tasks = [asyncio.ensure_future(client.get_pixels('graph', refresh=True)) for _ in range(3)]
+        tasks.append(asyncio.ensure_future(other.get_pixels('graph', refresh=True)))
+        await asyncio.sleep(0)
+        session.release.set()
+        results = await asyncio.gather(*tasks)
+        assert results[0] == results[1] == results[2] == results[3]
+        assert len(session.calls) == 2
+        assert flights.stats() == {'in_flight': 0, 'calls': 2, 'shared': 2, 'shared_rate': 0.5}
+
+    async def test_writes_are_not_shared(self):
+        session = SlowSession(FakeResponse(), FakeResponse())
+        flights = Singleflight()
+        client = PixelaClient(session, 'token', 'md-user', pixels=PixelCache(), flights=flights)
+        tasks = [asyncio.ensure_future(client.post_pixel('graph', '20220101', 1)) for _ in range(2)]
+        await asyncio.sleep(0)
+        session.release.set()
+        await asyncio.gather(*tasks)
+        assert len(session.calls) == 2
+        assert flights.calls == 0
+
+    async def test_cancelled_caller_does_not_cancel_others(self):
+        session = SlowSession(PIXELS)
+        client = PixelaClient(session, 'token', 'md-user', pixels=PixelCache(), flights=Singleflight())
+        first = asyncio.ensure_future(client.get_pixels('graph', refresh=True))
+        second = asyncio.ensure_future(client.get_pixels('graph', refresh=True))
+        await asyncio.sleep(0)
+        first.cancel()
+        session.release.set()
+        assert len(await second) == 2
+        assert len(session.calls) == 1
+
+
+@pytest.mark.asyncio
+@patch('pixela.asyncio.sleep')
+class TestCircuitBreaker:
+    @staticmethod
+    def client(session: FakeSession, breaker: CircuitBreaker) -> PixelaClient:
+        return PixelaClient(session, 'token', 'md-user', retry=RetryPolicy(attempts=1),
+                            limiter=RateLimiter(rate=0, user_rate=0), pixels=PixelCache(),
+                            flights=Singleflight(), breaker=breaker)
+
+    async def test_opens_and_fails_fast(self, sleep):
+        breaker = CircuitBreaker(failures=2, reset=30)
+        session = FakeSession(aiohttp.ServerTimeoutError(), FakeResponse(502, '{"message": "Bad gateway."}'))
+        client = self.client(session, breaker)
+        with patch('pixela.time.monotonic', return_value=100):
+            with pytest.raises(PixelaUnavailableException, match=UNAVAILABLE_MESSAGE):
+                await client.get_pixels('graph', refresh=True)
+            with pytest.raises(PixelaDataException, match='Bad gateway.'):
+                await client.get_pixels('graph', refresh=True)
+            with pytest.raises(PixelaUnavailableException, match='повторите через 30 с'):
+                await client.get_pixels('graph', refresh=True)
+            assert breaker.stats() == {'state': 'open', 'failures': 2, 'opens': 1, 'rejected': 1, 'retry_in': 30}
+        assert len(session.calls) == 2
+
+    async def test_rejections_and_client_errors_are_not_failures(self, sleep):
+        breaker = CircuitBreaker(failures=1)
+        session = FakeSession(REJECTED, FakeResponse(404, '{"message": "Not found."}'))
+        client = self.client(session, breaker)
+        for _ in range(2):
+            with pytest.raises(PixelaDataException):
+                await client.get_pixels('graph', refresh=True)
+        assert breaker.state == CircuitBreaker.CLOSED
+
+    async def test_half_open_probe(self, sleep):
+        breaker = CircuitBreaker(failures=1, reset=30)
+        session = FakeSession(aiohttp.ServerTimeoutError(), aiohttp.ServerTimeoutError(), PIXELS)
+        client = self.client(session, breaker)
+        with patch('pixela.time.monotonic', return_value=100):
+            with pytest.raises(PixelaUnavailableException):
+                await client.get_pixels('graph', refresh=True)
+        with patch('pixela.time.monotonic', return_value=131):
+            with pytest.raises(PixelaUnavailableException, match=UNAVAILABLE_MESSAGE):
+                await client.get_pixels('graph', refresh=True)
+            assert breaker.state == CircuitBreaker.OPEN
+        with patch('pixela.time.monotonic', return_value=162):
+            assert len(await client.get_pixels('graph', refresh=True)) == 2
+        assert breaker.stats()['state'] == 'closed'
+        assert breaker.opens == 2
+
+
+def test_endpoint_timeouts():
+    client = PixelaClient(Mock(), 'token', 'md-user')
+    assert client.endpoint('POST', client.USERS_URL) == 'users'
+    assert client.endpoint('DELETE', client.user_url) == 'users'
+    assert client.endpoint('GET', client.graphs_url) == 'graphs'
+    assert client.endpoint('POST', client.graphs_url) == 'graphs'
+    assert client.endpoint('PUT', client.graph_url('g')) == 'graphs'
+    assert client.endpoint('DELETE', client.graph_url('g')) == 'graphs'
+    assert client.endpoint('GET', client.graph_url('g') + '/graph-def') == 'graphs'
+    assert client.endpoint('HEAD', client.graph_url('g') + '.html?mode=simple') == 'page'
+    assert client.endpoint('GET', client.graph_url('g') + '/pixels?withBody=true') == 'pixels'
+    assert client.endpoint('POST', client.graph_url('g') + '/pixels') == 'pixels'
+    assert client.endpoint('POST', client.graph_url('g')) == 'pixel'
+    assert client.endpoint('PUT', client.pixel_url('g', '20220101')) == 'pixel'
@@ -0,0 +1,254 @@
+"""
+Tests storing and retrieving users locally without database.
+"""
+
+from datetime import date
+from unittest.mock import AsyncMock, Mock, patch
+import pytest
+import pytest_asyncio
+from storage import MemoryStorage, SQLiteStorage, PostgresStorage, aiosqlite, asyncpg
+from utils import *
+
+
+class TestUserCache:
+    def test_lru_eviction(self):
+        evicted = []
+        cache = UserCache(max_size=2, ttl=60, on_evict=evicted.append)
+        users = [User(id=i, first_name=f'user{i}') for i in range(3)]
+        cache.update({users[0].id: users[0], users[1].id: users[1]})
+        assert cache.get(0) is users[0]
+        cache.update({users[2].id: users[2]})
+        assert evicted == [users[1]]
+        assert cache.get(1) is None
+        assert cache.stats() == {'size': 2, 'hits': 1, 'misses': 1, 'evictions': 1}
+
+    def test_ttl_expiration(self):
+        cache = UserCache(max_size=10, ttl=60)
+        user = User(id=1, first_name='user')
+        with patch('utils.time.monotonic', return_value=0):
+            cache.update({user.id: user})
+        with patch('utils.time.monotonic', return_value=61):
+            assert cache.get(1) is None
+        assert len(cache) == 0
+
+    def test_dirty_user_is_kept_for_writer(self):
+        cache = UserCache(max_size=1, ttl=60)
+        user = User(id=1, first_name='user')
+        cache.update({user.id: user})
+        user.state = 'default'
+        cache.update({2: User(id=2, first_name='other')})
+        assert user_writer.pending.pop(1) is user
+
+
+@pytest.mark.asyncio
+class TestGetUser:
+    async def test_evicted_dirty_user_is_returned(self):
+        cache = UserCache(max_size=1, ttl=60)
+        user = User(id=1, first_name='user')
+        user_writer.mark(user)
+        assert await get_user(1, cache) is user
+        assert cache.get(1) is user
+        user_writer.pending.clear()
+
+
+@pytest.mark.asyncio
+class TestWarmupUsers:
+    async def test_pending_users_are_not_overwritten(self):
+        await database.save_users(('user_state',), [(1, 'user', 'old'), (2, 'other', 'old')])
+        cache = UserCache(max_size=10, ttl=60)
+        user = User(id=1, first_name='user', state='new')
+        user_writer.mark(user)
+        assert await warmup_users(cache) == 1
+        assert 1 not in cache
+        assert await get_user(1, cache) is user
+        user_writer.pending.clear()
+        database.users.clear()
+
+
+class TestInvalidateUsers:
+    def test_other_instance_changes(self):
+        cache = UserCache(max_size=10, ttl=60)
+        users = [User(id=i, first_name=f'user{i}') for i in range(3)]
+        cache.update({user.id: user for user in users})
+        user_writer.mark(users[1])
+        invalidate_users(cache, 'other-instance 0,1')
+        assert 0 not in cache
+        assert cache.get(1) is users[1]
+        assert cache.get(2) is users[2]
+        user_writer.pending.clear()
+
+    @pytest.mark.asyncio
+    async def test_users_being_written_are_kept(self):
+        cache = UserCache(max_size=10, ttl=60)
+        user = User(id=1, first_name='user')
+        cache.update({user.id: user})
+        user.state = 'default'
+        user_writer.mark(user)
+
+        async def save_users(columns, rows):
+            invalidate_users(cache, 'other-instance 1')
+
+        with patch.object(database, 'save_users', save_users):
+            await user_writer.flush()
+        assert cache.get(1) is user
+        assert not user_writer.in_flight
+
+    def test_own_changes_are_ignored(self):
+        cache = UserCache(max_size=10, ttl=60)
+        user = User(id=1, first_name='user')
+        cache.update({user.id: user})
+        invalidate_users(cache, INSTANCE_ID + ' 1')
+        assert cache.get(1) is user
+
+
+class TestUserChanges:
+    def test_new_user_has_no_changes(self):
+        user = User(id=1, first_name='user', pixela_name='md-user', state='default')
+        assert user.changed_attributes() == ()
+
+    def test_stored_attributes_are_tracked(self):
+        user = User(id=1, first_name='user')
+        user.pixels = []
+        user.first_name = 'renamed'
+        assert user.changed_attributes() == ()
+        user.graph = Graph(id='g1')
+        user.state = 'default'
+        user.state = 'other'
+        assert user.changed_attributes() == ('state', 'graph')
+
+    def test_take_changes_marks_saved(self):
+        user = User(id=1, first_name='user')
+        user.editting = True
+        assert take_changes(user) == ('editting',)
+        assert user.changed_attributes() == ()
+        user.mark_changed(('pixel', 'editting'))
+        assert user.changed_attributes() == ('pixel', 'editting')
+
+
+@pytest.mark.asyncio
+class TestUserWriter:
+    @pytest.fixture(autouse=True)
+    def clear_database(self):
+        yield
+        database.users.clear()
+
+    async def test_saves_are_coalesced(self):
+        writer = UserWriter()
+        user = User(id=1, first_name='user')
+        user.state = 'one'
+        writer.mark(user)
+        user.state = 'two'
+        user.pixela_name = 'md-user'
+        writer.mark(user)
+        with patch.object(database, 'save_users', wraps=database.save_users) as save_users:
+            await writer.flush()
+        save_users.assert_called_once_with(('pixela_name', 'user_state'), [(1, 'user', 'md-user', 'two')])
+        assert not writer.pending and user.changed_attributes() == ()
+        assert (await database.fetch_user(1))['user_state'] == 'two'
+
+    async def test_users_are_grouped_by_columns(self):
+        writer = UserWriter()
+        users = [User(id=i, first_name=f'user{i}') for i in range(4)]
+        users[0].state = users[1].state = 'default'
+        users[2].graph = Graph(id='g1')
+        for user in users:
+            writer.mark(user)
+        with patch.object(database, 'save_users', wraps=database.save_users) as save_users:
+            await writer.flush()
+        assert [call.args for call in save_users.call_args_list] == [
+            (('user_state',), [(0, 'user0', 'default'), (1, 'user1', 'default')]),
+            (('graph',), [(2, 'user2', Graph(id='g1')._asdict())])]
+        assert await database.fetch_user(3) is None
+
+    async def test_failed_write_returns_users(self):
+        writer = UserWriter()
+        user = User(id=1, first_name='user')
+        user.state = 'default'
+        writer.mark(user)
+        with patch.object(database, 'save_users', AsyncMock(side_effect=OSError('connection lost'))):
+            with pytest.raises(OSError):
+                await writer.flush()
+        assert writer.pending == {1: user}
+        assert not writer.in_flight
+        assert user.changed_attributes() == ('state',)
+        user.pixela_name = 'md-user'
+        await writer.flush()
+        assert (await database.fetch_user(1))['pixela_name'] == 'md-user'
+        assert (await database.fetch_user(1))['user_state'] == 'default'
+
+
+@pytest.mark.skipif(asyncpg is None, reason='asyncpg is not installed')
+def test_postgres_save_users_query():
+    query = PostgresStorage._save_users_query(('user_state', 'graph'))
+    assert 'INSERT INTO users (telegram_id, username, user_state, graph) VALUES ($1, $2, $3, $4)' in query
+    assert ('ON CONFLICT (telegram_id) DO UPDATE SET username = EXCLUDED.username, '
+            'user_state = EXCLUDED.user_state, graph = EXCLUDED.graph;') in query
+    assert PostgresStorage._save_users_query(('user_state', 'graph')) is query
+
+
+@pytest.mark.asyncio
+class TestPixelsCache:
+    async def test_database_errors_are_ignored(self):
+        failing = AsyncMock(side_effect=OSError('connection lost'))
+        with patch.multiple(database, replace_pixels=failing, save_pixel=failing, delete_pixel=failing):
+            await cache_pixels(1, 'g1', [{'date': '20220101', 'quantity': '1'}])
+            await cache_pixel(1, 'g1', '20220101', 1)
+            await uncache_pixel(1, 'g1', '20220101')
+        assert failing.call_count == 3
+
+
+@pytest_asyncio.fixture(params=['memory', 'sqlite'])
+async def storage(request, tmp_path):
+    if request.param == 'sqlite':
+        if aiosqlite is None:
+            pytest.skip('aiosqlite is not installed')
+        storage = SQLiteStorage(str(tmp_path / 'bot.db'))
+    else:
+        storage = MemoryStorage()
+    await storage.connect()
+    yield storage
+    await storage.close()
+
+
+@pytest.mark.asyncio
+class TestStorage:
+    async def test_save_and_fetch_user(self, storage):
+        graph = {'id': 'g1', 'name': 'test', 'unit': 'min', 'type': 'int', 'color': 'shibafu'}
+        await storage.save_users(('user_state', 'graph'), [(1, 'user', 'default', graph)])
+        await storage.save_users(('pixela_name',), [(1, 'user', 'md-user')])
+        user = user_from_record(await storage.fetch_user(1))
+        assert (user.pixela_name, user.state, user.graph) == ('md-user', 'default', Graph(**graph))
+        assert await storage.fetch_user(2) is None
+        assert [item['telegram_id'] async for item in storage.iterate_users(1)] == [1]
+
+    async def test_fetch_month(self, storage):
+        await storage.replace_pixels(1, 'g1', [(date(2022, 1, 31), '1'), (date(2022, 3, 1), '2'),
+                                               (date(2022, 3, 5), '3')])
+        await storage.save_pixel(1, 'g1', date(2022, 4, 2), '4')
+        await storage.delete_pixel(1, 'g1', date(2022, 3, 5))
+        assert await storage.fetch_month(1, 'g1', date(2022, 2, 1), 'next') == [
+            (date(2022, 3, 1), '2'), (date(2022, 4, 2), '4')]
+        assert await storage.fetch_month(1, 'g1', date(2022, 3, 1), 'prev') == [(date(2022, 1, 31), '1')]
+        assert await storage.fetch_month(1, 'g1', date(2022, 5, 1), 'next') == []
+
+    async def test_delete_graph_and_user_pixels(self, storage):
+        for user_id, graph_id in ((1, 'g1'), (1, 'g2'), (2, 'g1')):
+            await storage.save_pixel(user_id, graph_id, date(2022, 1, 1), '1')
+        await storage.delete_graph_pixels(1, 'g1')
+        assert await storage.fetch_month(1, 'g1', date(2022, 1, 1), 'next') == []
+        assert await storage.fetch_month(1, 'g2', date(2022, 1, 1), 'next') == [(date(2022, 1, 1), '1')]
+        await storage.delete_user_pixels(1)
+        assert await storage.fetch_month(1, 'g2', date(2022, 1, 1), 'next') == []
+        assert await storage.fetch_month(2, 'g1', date(2022, 1, 1), 'next') == [(date(2022, 1, 1), '1')]
+
+
+@pytest.mark.asyncio
+@pytest.mark.skipif(asyncpg is None, reason='asyncpg is not installed')
+class TestPostgresStorage:
+    async def test_timeout_does_not_expire_connections(self):
+        storage = PostgresStorage('postgres://localhost/test')
+        storage.pool = Mock(acquire=Mock(side_effect=asyncio.TimeoutError), expire_connections=AsyncMock())
+        with pytest.raises(asyncio.TimeoutError):
+            await storage.fetch_user(1)
+        assert storage.pool.acquire.call_count == 1
+        storage.pool.expire_connections.assert_not_called()
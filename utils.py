@@ -2,59 +2,108 @@
 Module for managing storing and retrieving data about users.
 """
 
-import json
+import asyncio
+import functools
+import logging
 from datetime import datetime, date
-from typing import Union
-import asyncpg
+from collections import OrderedDict
+from typing import Union, List, Optional, Iterable, Dict, Tuple, Callable, NamedTuple, Mapping
 import os
+import time
+import uuid
+from storage import create_storage
 
 
-HEROKU = os.getenv('HEROKU', False)
-if HEROKU:
-    DATABASE_URL = os.environ['DATABASE_URL']
-else:
-    from config import DATABASE_USER, DATABASE_PASSWORD, DATABASE_NAME, DATABASE_URL
+# Load all users into local storage in background on startup
+WARMUP_USERS = os.getenv('WARMUP_USERS', 'false').lower() not in ('0', 'false', 'no')
+WARMUP_CHUNK_SIZE = int(os.getenv('WARMUP_CHUNK_SIZE', default=1000))
+# Seconds to remember ids not found in database
+UNKNOWN_USERS_TTL = float(os.getenv('UNKNOWN_USERS_TTL', default=300))
+UNKNOWN_USERS_MAX_SIZE = 10000
+UNKNOWN_USERS = {}
 
+# Bounds of local users storage
+USERS_CACHE_SIZE = int(os.getenv('USERS_CACHE_SIZE', default=10000))
+USERS_CACHE_TTL = float(os.getenv('USERS_CACHE_TTL', default=3600))
 
-class Database:
+# Postpone saving users and write them in batches
+WRITE_BEHIND = os.getenv('WRITE_BEHIND', 'true').lower() not in ('0', 'false', 'no')
+USER_FLUSH_INTERVAL = float(os.getenv('USER_FLUSH_INTERVAL', default=1))
+USER_FLUSH_BATCH_SIZE = int(os.getenv('USER_FLUSH_BATCH_SIZE', default=500))
+
+# Notify other bot instances about changed users, so they drop stale copies
+SYNC_USERS = os.getenv('SYNC_USERS', 'true').lower() not in ('0', 'false', 'no')
+USERS_CHANNEL = 'users_changed'
+# Identifies this instance to skip its own notifications
+INSTANCE_ID = uuid.uuid4().hex[:12]
+# Notification payload is limited to 8000 bytes
+NOTIFY_IDS_CHUNK_SIZE = 500
+
+logger = logging.getLogger(__name__)
+
+database = create_storage()
+
+
+class Graph(NamedTuple):
     """
-    Class to manipulate with connection to database.
+    Class representing graph definition. Records are immutable, so changed graph is replaced as a whole.
     """
+    id: Optional[str] = None
+    name: Optional[str] = None
+    unit: Optional[str] = None
+    type: Optional[str] = None
+    color: Optional[str] = None
 
-    def __init__(self, url: str, name: str = '', user: str = '', pwd: str = ''):
-        self.url = url
-        self.name = name
-        self.user = user
-        self.pwd = pwd
-        self.conn: asyncpg.connection.Connection = None
-
-    async def connect(self):
+    @classmethod
+    def from_dict(cls, data: Optional[dict]) -> 'Graph':
         """
-        Making connection.
+        Creates graph from dict, e.g. received from pixela or database.
         """
-        if not HEROKU:
-            self.conn = await asyncpg.connect(user=self.user, password=self.pwd,
-                                              database=self.name, host=self.url)
-        else:
-            self.conn = await asyncpg.connect(self.url)
+        if not data:
+            return EMPTY_GRAPH
+        return cls(*(data.get(field) for field in cls._fields))
+
+
+class Pixel(NamedTuple):
+    """
+    Class representing pixel of a graph.
+    """
+    date: Optional[str] = None
+    quantity: Optional[Union[int, float]] = None
 
-    async def close(self):
+    @classmethod
+    def from_dict(cls, data: Optional[dict]) -> 'Pixel':
         """
-        Close connection.
+        Creates pixel from dict, e.g. received from database.
         """
-        await self.conn.close()
+        if not data:
+            return EMPTY_PIXEL
+        return cls(*(data.get(field) for field in cls._fields))
 
 
-if not HEROKU:
-    database = Database(url=DATABASE_URL, name=DATABASE_NAME, pwd=DATABASE_PASSWORD, user=DATABASE_USER)
-else:
-    database = Database(DATABASE_URL)
+EMPTY_GRAPH = Graph()
+EMPTY_PIXEL = Pixel()
+
+# User attributes stored in database and their columns
+USER_COLUMNS = {
+    'pixela_token': 'pixela_token',
+    'pixela_name': 'pixela_name',
+    'state': 'user_state',
+    'graph': 'graph',
+    'pixel': 'pixel',
+    'editting': 'editting',
+}
+# Bit flag of each stored attribute for tracking changes
+USER_COLUMN_FLAGS = {attr: 1 << i for i, attr in enumerate(USER_COLUMNS)}
 
 
 class User:
     """
     Class to save user's state and various user-related data.
+    Keeps track of attributes changed since last save, so only those are written to database.
     """
+    __slots__ = ('id', 'first_name', 'pixela_token', 'pixela_name', 'state', 'graph', 'pixel',
+                 'pixels', 'editting', 'changed')
 
     def __init__(self, id: int, first_name: str, pixela_token: str = None,
                  pixela_name: str = None, state: str = None):
@@ -66,19 +115,48 @@ class User:
         :param state: current user's state
         graph: current chosen graph
         pixel: current chosen pixel
-        pixels: list of all available pixels (storing them for calendar implementation)
+        pixels: list of all available pixels (storing them for calendar implementation),
+        they are not saved with user, but cached in pixels_cache table
         editting: whether the graph is being edited or created
+        changed: bit flags of attributes changed since last save
         """
+        self.changed = 0
         self.id = id
         self.first_name = first_name
         self.pixela_token = pixela_token
         self.pixela_name = pixela_name
         self.state = state
-        self.graph = {'id': None, 'name': None, 'unit': None, 'type': None, 'color': None}
-        self.pixel = {'date': None, 'quantity': None}
+        self.graph = EMPTY_GRAPH
+        self.pixel = EMPTY_PIXEL
         self.pixels = None
         self.editting = False
-        self.session = None
+        self.mark_saved()
+
+    def __setattr__(self, name, value):
+        flag = USER_COLUMN_FLAGS.get(name)
+        if flag:
+            object.__setattr__(self, 'changed', self.changed | flag)
+        object.__setattr__(self, name, value)
+
+    def changed_attributes(self) -> Tuple[str, ...]:
+        """
+        Gets attributes changed since last save.
+        :return: attribute names
+        """
+        return tuple(attr for attr, flag in USER_COLUMN_FLAGS.items() if self.changed & flag)
+
+    def mark_changed(self, attributes: Iterable[str]):
+        """
+        Marks attributes as changed, e.g. when saving them failed.
+        """
+        for attr in attributes:
+            self.changed |= USER_COLUMN_FLAGS[attr]
+
+    def mark_saved(self):
+        """
+        Marks current data as saved to database.
+        """
+        self.changed = 0
 
     def __str__(self):
         return (f'User {self.first_name} with id {self.id} in state {self.state}. ' +
@@ -89,13 +167,13 @@ class User:
         """
         Resetting graph to initial state.
         """
-        self.graph = {'id': None, 'name': None, 'unit': None, 'type': None, 'color': None}
+        self.graph = EMPTY_GRAPH
 
     def reset_pixel(self):
         """
         Resetting pixel to initial state.
         """
-        self.pixel = {'date': None, 'quantity': None}
+        self.pixel = EMPTY_PIXEL
 
     def reset(self):
         """
@@ -105,73 +183,506 @@ class User:
         self.pixela_token = None
         self.state = None
         self.editting = False
-        self.graph = {'id': None, 'name': None, 'unit': None, 'type': None, 'color': None}
-        self.pixel = {'date': None, 'quantity': None}
+        self.graph = EMPTY_GRAPH
+        self.pixel = EMPTY_PIXEL
         self.pixels = None
-        self.session = None
 
 
-async def get_user(id: int, container: dict) -> User:
+def serialize_attribute(user: User, attr: str):
+    """
+    Gets value of user attribute suitable for database. Records are stored as json objects.
+    :param user: user object
+    :param attr: attribute name
+    :return: value
+    """
+    value = getattr(user, attr)
+    if isinstance(value, (Graph, Pixel)):
+        return value._asdict()
+    return value
+
+
+def user_from_record(item: Mapping) -> User:
+    """
+    Creates user object from database record.
+    :param item: record from users table, any mapping with its columns
+    :return: user object
+    """
+    user = User(
+        id=item['telegram_id'],
+        first_name=item['username'],
+        pixela_token=item['pixela_token'],
+        pixela_name=item['pixela_name'],
+        state=item['user_state']
+    )
+    user.graph = Graph.from_dict(item['graph'])
+    user.pixel = Pixel.from_dict(item['pixel'])
+    user.editting = item['editting']
+    user.mark_saved()
+    return user
+
+
+def is_unknown_user(id: int) -> bool:
+    """
+    Checks whether user was recently looked up in database and not found.
+    :param id: user id
+    :return:
+    """
+    expires = UNKNOWN_USERS.get(id)
+    if expires is None:
+        return False
+    if expires < time.monotonic():
+        del UNKNOWN_USERS[id]
+        return False
+    return True
+
+
+async def get_user(id: int, container: dict) -> Optional[User]:
     """
-    Gets user data first from local container. If container is empty, retrieves data from database.
-    Creates user object from received data.
+    Gets user data first from local container. On cache miss retrieves only requested user
+    from database.
+    Unknown ids are remembered for a while to avoid repeated queries for new users.
     :param id: user id
     :param container: local storage
     :return: user object
     """
-    if not container.keys():
-        users = await database.conn.fetch('SELECT * FROM users')
-        for item in users:
-            user = User(
-                id=item['telegram_id'],
-                first_name=item['username'],
-                pixela_token=item['pixela_token'],
-                pixela_name=item['pixela_name'],
-                state=item['user_state']
-            )
-            if item['graph'] and item['graph'] != 'null':
-                user.graph = json.loads(item['graph'])
-            else:
-                user.reset_graph()
-            if item['pixel'] and item['pixel'] != 'null':
-                user.pixel = json.loads(item['pixel'])
-            else:
-                user.reset_pixel()
-            user.pixels = json.loads(item['pixels']) if item['pixels'] and item['pixels'] != 'null' \
-                else None
-            user.editting = item['editting']
-            container.update({user.id: user})
-    return container.get(id)
+    user = container.get(id)
+    if user is not None or is_unknown_user(id):
+        return user
+    # User could be evicted from container before its changes were written
+    user = user_writer.get(id)
+    if user is not None:
+        container.update({user.id: user})
+        return user
+    item = await database.fetch_user(id)
+    if item is None:
+        if len(UNKNOWN_USERS) >= UNKNOWN_USERS_MAX_SIZE:
+            UNKNOWN_USERS.clear()
+        UNKNOWN_USERS[id] = time.monotonic() + UNKNOWN_USERS_TTL
+        return None
+    user = user_from_record(item)
+    container.update({user.id: user})
+    return user
+
+
+def user_to_args(user: User, attributes: Tuple[str, ...]) -> tuple:
+    """
+    Prepares user's data as row for saving in storage.
+    :param user: user object
+    :param attributes: attributes to save
+    :return: tuple of telegram id, username and values of attributes
+    """
+    values = tuple(serialize_attribute(user, attr) for attr in attributes)
+    return (user.id, user.first_name) + values
+
+
+def attributes_to_columns(attributes: Tuple[str, ...]) -> Tuple[str, ...]:
+    """
+    Gets database columns of given user attributes.
+    """
+    return tuple(USER_COLUMNS[attr] for attr in attributes)
+
+
+def take_changes(user: User) -> Tuple[str, ...]:
+    """
+    Gets changed attributes of user and marks them as saved.
+    :param user: user object
+    :return: attribute names
+    """
+    attributes = user.changed_attributes()
+    user.mark_saved()
+    return attributes
+
+
+class UserWriter:
+    """
+    Class to postpone saving users to database and write them in batches.
+    Several saves of the same user before flush are coalesced into one write.
+    """
+
+    def __init__(self, interval: float = USER_FLUSH_INTERVAL, batch_size: int = USER_FLUSH_BATCH_SIZE):
+        """
+        :param interval: seconds between flushes
+        :param batch_size: number of pending users which triggers flush right away
+        """
+        self.interval = interval
+        self.batch_size = batch_size
+        self.pending: Dict[int, User] = {}
+        # Users taken from pending whose batch is being written right now
+        self.in_flight: Dict[int, User] = {}
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    def get(self, id: int) -> Optional[User]:
+        """
+        Gets user with changes not yet written to database.
+        :param id: user id
+        :return: pending or being written user, None if there is no such
+        """
+        return self.pending.get(id) or self.in_flight.get(id)
+
+    def mark(self, user: User):
+        """
+        Marks user as dirty, so it will be saved on next flush.
+        """
+        self.pending[user.id] = user
+        if self._task and len(self.pending) >= self.batch_size:
+            asyncio.ensure_future(self._safe_flush())
+
+    def start(self):
+        """
+        Starts periodic flushing in background.
+        """
+        if not self._task:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self._safe_flush()
+
+    async def _safe_flush(self):
+        try:
+            await self.flush()
+        except Exception as exc:
+            logger.error('Failed to save users: %s.', exc)
+
+    async def flush(self):
+        """
+        Writes all pending users to database with single executemany.
+        Users which failed to be written are returned to pending.
+        """
+        async with self._lock:
+            if not self.pending:
+                return
+            users = list(self.pending.values())
+            self.pending.clear()
+            # Group users by changed attributes to write each group with single query
+            batches: Dict[Tuple[str, ...], List[tuple]] = {}
+            changes = []
+            for user in users:
+                attributes = take_changes(user)
+                if attributes:
+                    batches.setdefault(attributes, []).append(user_to_args(user, attributes))
+                    changes.append((user, attributes))
+            self.in_flight = {user.id: user for user, _ in changes}
+            try:
+                for attributes, rows in batches.items():
+                    await database.save_users(attributes_to_columns(attributes), rows)
+            except BaseException:
+                for user, attributes in changes:
+                    user.mark_changed(attributes)
+                    self.pending.setdefault(user.id, user)
+                raise
+            finally:
+                self.in_flight = {}
+        await notify_users_changed([user.id for user, _ in changes])
+
+    async def stop(self):
+        """
+        Stops background flushing and saves everything left.
+        """
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+
+
+user_writer = UserWriter()
+
+
+class UserCache:
+    """
+    Local storage of users bounded by size and time since last access.
+    Least recently used users are evicted first. Evicted users with unsaved changes
+    are handed to user writer, then on_evict callback releases their resources.
+    """
+
+    def __init__(self, max_size: int = USERS_CACHE_SIZE, ttl: float = USERS_CACHE_TTL,
+                 on_evict: Optional[Callable[[User], None]] = None):
+        """
+        :param max_size: maximum number of users to keep
+        :param ttl: seconds after last access before user is evicted
+        :param on_evict: function called with evicted user
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.on_evict = on_evict
+        self._users: 'OrderedDict[int, Tuple[User, float]]' = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, id: int, default: Optional[User] = None) -> Optional[User]:
+        item = self._users.get(id)
+        if item is None:
+            self.misses += 1
+            return default
+        user, expires = item
+        now = time.monotonic()
+        if expires < now:
+            self._evict(id)
+            self.misses += 1
+            return default
+        self._users[id] = (user, now + self.ttl)
+        self._users.move_to_end(id)
+        self.hits += 1
+        return user
+
+    def __setitem__(self, id: int, user: User):
+        self._users[id] = (user, time.monotonic() + self.ttl)
+        self._users.move_to_end(id)
+        self._shrink()
+
+    def __getitem__(self, id: int) -> User:
+        user = self.get(id)
+        if user is None:
+            raise KeyError(id)
+        return user
+
+    def __contains__(self, id: int) -> bool:
+        return id in self._users
+
+    def __len__(self) -> int:
+        return len(self._users)
+
+    def update(self, users: dict):
+        for id, user in users.items():
+            self[id] = user
+
+    def pop(self, id: int, default: Optional[User] = None) -> Optional[User]:
+        item = self._users.pop(id, None)
+        return item[0] if item else default
+
+    def keys(self):
+        return self._users.keys()
+
+    def values(self):
+        return [user for user, _ in self._users.values()]
+
+    def stats(self) -> dict:
+        """
+        Gets cache counters.
+        """
+        return {'size': len(self._users), 'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions}
+
+    def _shrink(self):
+        """
+        Evicts expired users from the least recently used end and then extra users over max size.
+        """
+        now = time.monotonic()
+        while self._users:
+            id, (_, expires) = next(iter(self._users.items()))
+            if expires >= now and len(self._users) <= self.max_size:
+                break
+            self._evict(id)
+
+    def _evict(self, id: int):
+        user, _ = self._users.pop(id)
+        self.evictions += 1
+        if user.changed_attributes():
+            user_writer.mark(user)
+        if self.on_evict:
+            self.on_evict(user)
+
+
+async def warmup_users(container: UserCache, chunk_size: int = WARMUP_CHUNK_SIZE) -> int:
+    """
+    Loads users into local container, streaming them from storage chunk by chunk. Users already loaded by handlers are kept, loading stops when container is full.
+    :param container: local storage
+    :param chunk_size: number of users fetched at once
+    :return: number of loaded users
+    """
+    logger.info('Warming up users.')
+    loaded = 0
+    async for item in database.iterate_users(chunk_size):
+        if len(container) >= container.max_size:
+            logger.info('Users storage is full.')
+            break
+        id = item['telegram_id']
+        # Users with unsaved changes are newer than their rows, get_user takes them from writer
+        if id not in container and user_writer.get(id) is None:
+            container[id] = user_from_record(item)
+            loaded += 1
+            if loaded % chunk_size == 0:
+                logger.info('Warmed up %d users.', loaded)
+    logger.info('Warmup finished, %d users loaded.', loaded)
+    return loaded
 
 
 async def save_user(user: User):
     """
-    Updates user's data inside database.
+    Updates user's data inside database. With write-behind user is only marked dirty
+    and saved later by user writer.
     :param user: user object
     :return:
     """
-    query = '''
-    UPDATE users 
-    SET (pixela_token, pixela_name, 
-    user_state, graph, pixel, pixels, editting) =
-    ($1, $2, $3, $4, $5, $6, $7)
-    WHERE telegram_id = $8 AND username = $9;
-    '''
-    await database.conn.execute(query, user.pixela_token, user.pixela_name, user.state,
-                                json.dumps(user.graph), json.dumps(user.pixel),
-                                json.dumps(user.pixels), user.editting, user.id, user.first_name)
+    if WRITE_BEHIND:
+        user_writer.mark(user)
+        return
+    attributes = take_changes(user)
+    if attributes:
+        try:
+            await database.save_users(attributes_to_columns(attributes), [user_to_args(user, attributes)])
+        except BaseException:
+            user.mark_changed(attributes)
+            raise
+        await notify_users_changed([user.id])
 
 
 async def create_db_user(user: User):
     """
-    Creates record inside database for given user.
+    Creates record inside database for given user. All attributes are written with the same upsert
+    as in save_user, so with write-behind new user costs no extra round-trip.
     :param user: user object
     :return:
     """
-    query = '''
-    INSERT INTO users (telegram_id, username, user_state, editting) VALUES ($1, $2, $3, $4);
-    '''
-    await database.conn.execute(query, user.id, user.first_name, user.state, False)
+    user.mark_changed(USER_COLUMNS)
+    UNKNOWN_USERS.pop(user.id, None)
+    await save_user(user)
+
+
+async def notify_users_changed(ids: List[int]):
+    """
+    Notifies other bot instances that given users were changed in database.
+    Payload is id of this instance followed by comma separated user ids.
+    :param ids: user ids
+    :return:
+    """
+    if not SYNC_USERS:
+        return
+    for i in range(0, len(ids), NOTIFY_IDS_CHUNK_SIZE):
+        chunk = ids[i:i + NOTIFY_IDS_CHUNK_SIZE]
+        try:
+            await database.notify(USERS_CHANNEL, INSTANCE_ID + ' ' + ','.join(map(str, chunk)))
+        except Exception as exc:
+            logger.error('Failed to notify about changed users: %s.', exc)
+
+
+def invalidate_users(container: UserCache, payload: str):
+    """
+    Drops users changed by other bot instance from local storage, so they are reloaded on next request.
+    Users with local changes, unsaved or being written, are kept.
+    :param container: local storage
+    :param payload: notification payload
+    :return:
+    """
+    instance, _, ids = payload.partition(' ')
+    if instance == INSTANCE_ID or not ids:
+        return
+    for id in map(int, ids.split(',')):
+        UNKNOWN_USERS.pop(id, None)
+        if user_writer.get(id) is None:
+            container.pop(id)
+
+
+def invalidate_all_users(container: UserCache):
+    """
+    Drops all users without local unsaved changes from local storage.
+    :param container: local storage
+    :return:
+    """
+    UNKNOWN_USERS.clear()
+    for id in list(container.keys()):
+        if user_writer.get(id) is None:
+            container.pop(id)
+
+
+async def listen_users_changes(container: UserCache):
+    """
+    Starts invalidating local storage on notifications from other bot instances.
+    :param container: local storage
+    :return:
+    """
+    if SYNC_USERS:
+        await database.listen(USERS_CHANNEL, functools.partial(invalidate_users, container),
+                              on_reconnect=functools.partial(invalidate_all_users, container))
+
+
+async def cache_pixels(user_id: int, graph_id: str, pixels: List[dict]):
+    """
+    Replaces cached pixels of given graph with fresh ones.
+    Pixels are only cached, so failure to write them is logged and ignored.
+    :param user_id: telegram id
+    :param graph_id:
+    :param pixels: list of all pixels of the graph
+    :return:
+    """
+    try:
+        await database.replace_pixels(user_id, graph_id,
+                                      [(str_to_date(pixel['date']), str(pixel['quantity'])) for pixel in pixels])
+    except Exception as exc:
+        logger.error('Failed to cache pixels: %s.', exc)
+
+
+async def cache_pixel(user_id: int, graph_id: str, date_: str, quantity: Union[int, float, str]):
+    """
+    Adds or updates single cached pixel, failure is logged and ignored.
+    :param user_id: telegram id
+    :param graph_id:
+    :param date_: date in pixela format
+    :param quantity:
+    :return:
+    """
+    try:
+        await database.save_pixel(user_id, graph_id, str_to_date(date_), str(quantity))
+    except Exception as exc:
+        logger.error('Failed to cache pixel: %s.', exc)
+
+
+async def uncache_pixel(user_id: int, graph_id: str, date_: str):
+    """
+    Removes single pixel from cache, failure is logged and ignored.
+    :param user_id: telegram id
+    :param graph_id:
+    :param date_: date in pixela format
+    :return:
+    """
+    try:
+        await database.delete_pixel(user_id, graph_id, str_to_date(date_))
+    except Exception as exc:
+        logger.error('Failed to uncache pixel: %s.', exc)
+
+
+async def uncache_graph(user_id: int, graph_id: str):
+    """
+    Removes cached pixels of deleted graph, so graph created later with the same id starts empty.
+    Failure is logged and ignored.
+    :param user_id: telegram id
+    :param graph_id:
+    :return:
+    """
+    try:
+        await database.delete_graph_pixels(user_id, graph_id)
+    except Exception as exc:
+        logger.error('Failed to uncache graph: %s.', exc)
+
+
+async def uncache_user_pixels(user_id: int):
+    """
+    Removes cached pixels of all graphs of deleted user, failure is logged and ignored.
+    :param user_id: telegram id
+    :return:
+    """
+    try:
+        await database.delete_user_pixels(user_id)
+    except Exception as exc:
+        logger.error('Failed to uncache pixels of user: %s.', exc)
+
+
+async def get_cached_month(user_id: int, graph_id: str, month: date, direction: str) -> List[dict]:
+    """
+    Gets cached pixels of the closest month with pixels before (prev) or starting from (next)
+    given month, plus the nearest pixel outside of that month if there is one,
+    so calendar knows whether to show further direction button.
+    :param user_id: telegram id
+    :param graph_id:
+    :param month: first day of current month
+    :param direction: prev or next
+    :return: list of pixels with dates in pixela format
+    """
+    pixels = await database.fetch_month(user_id, graph_id, month, direction)
+    return [{'date': date_to_str(date_), 'quantity': quantity} for date_, quantity in pixels]
 
 
 def date_to_str(date_: Union[date, datetime]) -> str: